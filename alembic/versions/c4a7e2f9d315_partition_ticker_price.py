@@ -0,0 +1,76 @@
+"""partition ticker price by created_at
+
+Revision ID: c4a7e2f9d315
+Revises: 8b2e4d61c5a9
+Create Date: 2026-10-18 16:12:05.482117
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a7e2f9d315'
+down_revision = '8b2e4d61c5a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing prices are attached as a single legacy partition instead of being copied,
+    # daily partitions start from tomorrow and are maintained by `stock-price manage-partitions`
+    op.execute('ALTER TABLE ticker_price RENAME TO ticker_price_legacy')
+    op.execute('ALTER TABLE ticker_price_legacy DROP CONSTRAINT ticker_price_pkey')
+    op.execute('ALTER INDEX ix_ticker_price_created_at RENAME TO ix_ticker_price_legacy_created_at')
+    op.execute('ALTER INDEX ix_ticker_price_ticker_id RENAME TO ix_ticker_price_legacy_ticker_id')
+    op.execute(
+        '''
+        CREATE TABLE ticker_price (
+            id BIGINT NOT NULL DEFAULT nextval('ticker_price_id_seq'),
+            ticker_id BIGINT NOT NULL REFERENCES ticker (id),
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            price NUMERIC,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        '''
+    )
+    op.execute('ALTER TABLE ticker_price_legacy ALTER COLUMN id DROP DEFAULT')
+    op.execute('ALTER SEQUENCE ticker_price_id_seq OWNED BY ticker_price.id')
+    op.execute('CREATE INDEX ix_ticker_price_created_at ON ticker_price (created_at)')
+    op.execute('CREATE INDEX ix_ticker_price_ticker_id ON ticker_price (ticker_id)')
+    op.execute(
+        '''
+        DO $$
+        BEGIN
+            EXECUTE format(
+                'ALTER TABLE ticker_price ATTACH PARTITION ticker_price_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                date_trunc('day', now() AT TIME ZONE 'UTC') + interval '1 day' || '+00'
+            );
+        END
+        $$
+        '''
+    )
+    op.execute('CREATE TABLE ticker_price_default PARTITION OF ticker_price DEFAULT')
+
+
+def downgrade():
+    op.execute('ALTER TABLE ticker_price RENAME TO ticker_price_partitioned')
+    op.execute(
+        'ALTER TABLE ticker_price_partitioned RENAME CONSTRAINT ticker_price_pkey TO ticker_price_partitioned_pkey'
+    )
+    op.execute('ALTER INDEX ix_ticker_price_created_at RENAME TO ix_ticker_price_partitioned_created_at')
+    op.execute('ALTER INDEX ix_ticker_price_ticker_id RENAME TO ix_ticker_price_partitioned_ticker_id')
+    op.execute(
+        '''
+        CREATE TABLE ticker_price (
+            id BIGINT NOT NULL DEFAULT nextval('ticker_price_id_seq') PRIMARY KEY,
+            ticker_id BIGINT NOT NULL REFERENCES ticker (id),
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            price NUMERIC
+        )
+        '''
+    )
+    op.execute('INSERT INTO ticker_price SELECT id, ticker_id, created_at, price FROM ticker_price_partitioned')
+    op.execute('ALTER SEQUENCE ticker_price_id_seq OWNED BY ticker_price.id')
+    op.execute('DROP TABLE ticker_price_partitioned')
+    op.execute('CREATE INDEX ix_ticker_price_created_at ON ticker_price (created_at)')
+    op.execute('CREATE INDEX ix_ticker_price_ticker_id ON ticker_price (ticker_id)')
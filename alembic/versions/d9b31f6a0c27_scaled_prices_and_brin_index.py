@@ -0,0 +1,55 @@
+"""store prices as scaled bigint, index ticker_price by brin on created_at and by (ticker_id, id)
+
+Revision ID: d9b31f6a0c27
+Revises: c4a7e2f9d315
+Create Date: 2026-10-18 21:40:12.903315
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b31f6a0c27'
+down_revision = 'c4a7e2f9d315'
+branch_labels = None
+depends_on = None
+
+# must match stock_prices.db.PRICE_SCALE, which may change after this migration
+PRICE_SCALE = 4
+
+PRICE_COLUMNS = {
+    'ticker_price': ['price'],
+    'ticker_last_price': ['price'],
+    'ticker_candle': ['open', 'high', 'low', 'close'],
+}
+
+
+def upgrade():
+    # every partition of ticker_price is rewritten, so this takes a while on a big history
+    for table, columns in PRICE_COLUMNS.items():
+        op.execute(
+            f'ALTER TABLE {table} '
+            + ', '.join(
+                f'ALTER COLUMN {column} TYPE BIGINT USING round({column} * 10 ^ {PRICE_SCALE})::bigint'
+                for column in columns
+            )
+        )
+    op.execute('DROP INDEX ix_ticker_price_created_at')
+    op.execute('DROP INDEX ix_ticker_price_ticker_id')
+    op.execute('CREATE INDEX ix_ticker_price_created_at_brin ON ticker_price USING brin (created_at)')
+    op.execute('CREATE INDEX ix_ticker_price_ticker_id_id ON ticker_price (ticker_id, id)')
+
+
+def downgrade():
+    op.execute('DROP INDEX ix_ticker_price_ticker_id_id')
+    op.execute('DROP INDEX ix_ticker_price_created_at_brin')
+    op.execute('CREATE INDEX ix_ticker_price_created_at ON ticker_price (created_at)')
+    op.execute('CREATE INDEX ix_ticker_price_ticker_id ON ticker_price (ticker_id)')
+    for table, columns in PRICE_COLUMNS.items():
+        op.execute(
+            f'ALTER TABLE {table} '
+            + ', '.join(
+                f'ALTER COLUMN {column} TYPE NUMERIC USING {column}::numeric / 10 ^ {PRICE_SCALE}'
+                for column in columns
+            )
+        )
@@ -1,16 +1,26 @@
 const CHART_BACKGROUND_COLOR = 'rgb(255, 99, 132)';
 const CHART_BORDER_COLOR = 'rgb(255, 99, 132)';
 const MAX_PRICE_DEEP = undefined;
+const CHART_RESOLUTION = 1000;
+const SOCKET_RECONNECT_DELAY = 1000;
+const COLUMNAR_MEDIA_TYPE = 'application/vnd.stock-prices.columnar+json';
+const COLUMNAR_SUBPROTOCOL = 'prices.columnar';
+const TICKERS_PAGE_SIZE = 50;
+const TICKERS_SEARCH_DELAY = 250;
 
 let priceChart = undefined;
 let priceSocket = undefined;
+let trackedTicker = undefined;
+let lastStreamId = undefined;
+let resumeFrom = undefined;
+let tickerHistory = {};
+let tickersCursor = undefined;
 
 function addData(chart, label, data) {
   chart.data.labels.push(label);
   chart.data.datasets.forEach((dataset) => {
       dataset.data.push(data);
   });
-  chart.update();
 }
 
 function removeData(chart) {
@@ -18,52 +28,93 @@ function removeData(chart) {
   chart.data.datasets.forEach((dataset) => {
       dataset.data.shift();
   });
-  chart.update();
 }
 
 function initSocket() {
-  priceSocket = new WebSocket("ws://" + location.hostname + ":" + location.port + "/track-price");
+  if (priceSocket !== undefined)
+    return;
+
+  priceSocket = new WebSocket("ws://" + location.hostname + ":" + location.port + "/track-price", COLUMNAR_SUBPROTOCOL);
   
   priceSocket.onopen = function() {
       let tickerSelector = document.getElementById("ticker")
-      let tickerName = tickerSelector.value;
-      priceSocket.send(tickerName);
+      trackTicker(tickerSelector.value);
   }
 
   priceSocket.onmessage = function(event) {
-      let tickerData = JSON.parse(event.data);
+      let series = JSON.parse(event.data);
 
-      let time = new Date(tickerData.created_at);
-      addData(priceChart, time, tickerData.price);
+      series.forEach(tickerData => {
+        if (tickerData.name !== trackedTicker)
+          return;
+        if (tickerData.last_id !== undefined)
+          lastStreamId = tickerData.last_id;
+        tickerData.t.forEach((time, i) => addData(priceChart, new Date(time), tickerData.p[i]));
+      });
 
       while (MAX_PRICE_DEEP && priceChart.data.labels.length > MAX_PRICE_DEEP)
         removeData(priceChart);
+      priceChart.update();
+  };
+
+  priceSocket.onclose = function() {
+      if (trackedTicker !== undefined && lastStreamId !== undefined)
+        resumeFrom = {ticker: trackedTicker, id: lastStreamId};
+      priceSocket = undefined;
+      trackedTicker = undefined;
+      setTimeout(initSocket, SOCKET_RECONNECT_DELAY);
   };
 }
 
+function trackTicker(tickerName) {
+  if (priceSocket === undefined || priceSocket.readyState !== WebSocket.OPEN)
+    return;
+
+  if (trackedTicker !== undefined)
+    priceSocket.send(JSON.stringify({'action': 'unsubscribe', 'tickers': [trackedTicker]}));
+  let command = {'action': 'subscribe', 'tickers': [tickerName]};
+  // replay prices missed while reconnecting, a switched ticker gets its history from /ticker-price instead
+  if (resumeFrom !== undefined && resumeFrom.ticker === tickerName)
+    command['resume'] = {[tickerName]: resumeFrom.id};
+  resumeFrom = undefined;
+  lastStreamId = undefined;
+  trackedTicker = tickerName;
+  priceSocket.send(JSON.stringify(command));
+}
+
 function onTickerSelect() {
   let ticker_name = document.getElementById("ticker").value;
-
-  if (priceSocket)
-    priceSocket.close();
+  let params = {'ticker_name': ticker_name, 'resolution': CHART_RESOLUTION};
+  let history = tickerHistory[ticker_name];
+  if (history !== undefined && history.lastId !== undefined)
+    params['after_id'] = history.lastId;
 
   $.ajax('/ticker-price', {
     type: 'get',
-    data: $.param({'ticker_name': ticker_name}),
-    success: onTickerPriceReceive,
+    data: $.param(params),
+    headers: {'Accept': COLUMNAR_MEDIA_TYPE},
+    dataType: 'json',
+    success: function(response, status, xhr) {
+      mergeTickerHistory(ticker_name, response, xhr.getResponseHeader('X-Last-Id'));
+      if (ticker_name === document.getElementById("ticker").value)
+        onTickerPriceReceive(ticker_name);
+    },
   });
 }
 
-function onTickerPriceReceive(response) {
-  let labels = [];
-  let prices = [];
-  response.forEach(item => {
-    let time = new Date(item.created_at);
-    labels.push(time);
-    prices.push(item.price);
-  });
+function mergeTickerHistory(tickerName, response, lastId) {
+  let history = tickerHistory[tickerName] || {labels: [], prices: [], lastId: undefined};
+  history.labels = history.labels.concat(response.t.map(time => new Date(time)));
+  history.prices = history.prices.concat(response.p);
+  if (lastId !== null)
+    history.lastId = lastId;
+  tickerHistory[tickerName] = history;
+}
 
-  let ticker_name = document.getElementById("ticker").value;
+function onTickerPriceReceive(ticker_name) {
+  // the chart appends live prices to its arrays, the cache keeps only fetched ones
+  let labels = tickerHistory[ticker_name].labels.slice();
+  let prices = tickerHistory[ticker_name].prices.slice();
 
   const data = {
     labels: labels,
@@ -105,11 +156,36 @@ function onTickerPriceReceive(response) {
   
   priceChart = new Chart(canvas, config);
 
-  initSocket();
+  if (priceSocket === undefined)
+    initSocket();
+  else
+    trackTicker(ticker_name);
+}
+
+function searchTickers(params, success, failure) {
+  let query = {'q': params.data.term || '', 'limit': TICKERS_PAGE_SIZE};
+  if (params.data.page !== undefined && tickersCursor !== undefined)
+    query['cursor'] = tickersCursor;
+
+  return $.ajax('/tickers', {
+    type: 'get',
+    data: $.param(query),
+    dataType: 'json',
+    success: function(names, status, xhr) {
+      tickersCursor = xhr.getResponseHeader('X-Next-Cursor') || undefined;
+      success({
+        results: names.map(name => ({id: name, text: name})),
+        pagination: {more: tickersCursor !== undefined},
+      });
+    },
+    error: failure,
+  });
 }
 
 $(document).ready(function() {
-  $('.select-ticker').select2();
+  $('.select-ticker').select2({
+    ajax: {url: '/tickers', delay: TICKERS_SEARCH_DELAY, transport: searchTickers},
+  });
   onTickerSelect();
   $(".select-ticker").on("select2:select", function (e) { onTickerSelect(); });
 });
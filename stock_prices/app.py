@@ -4,12 +4,27 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.cors import CORSMiddleware
 
-from stock_prices.settings import CORSSettings
-from stock_prices.views import get_ticker_price, home, ticker_price
+from stock_prices import db, metrics
+from stock_prices.hub import PriceHub
+from stock_prices.latest_prices import LatestPrices, load_latest_prices
+from stock_prices.profiling import ProfilingMiddleware
+from stock_prices.settings import CORSSettings, DBSettings, ProfilingSettings, RedisSettings, WebSocketSettings
+from stock_prices.ticker_index import TickerIndex, load_ticker_names
+from stock_prices.views import (
+    get_latest_prices,
+    get_metrics,
+    get_ticker_candles,
+    get_ticker_price,
+    get_tickers,
+    home,
+    ticker_price,
+)
 
 if TYPE_CHECKING:
     from pathlib import Path
 
+    from aioredis import Redis
+
 
 def get_app(static_directory: Union[str, 'Path'] = 'static') -> FastAPI:
     app = FastAPI()
@@ -22,12 +37,64 @@ def get_app(static_directory: Union[str, 'Path'] = 'static') -> FastAPI:
             allow_credentials=True,
             allow_methods=['*'],
             allow_headers=['*'],
+            expose_headers=['X-Next-Cursor', 'X-Last-Id', 'ETag'],
         )
 
+    profiling_settings = ProfilingSettings()
+    profiling_settings.setup()
+    profiler = profiling_settings.create_profiler()
+    if profiler is not None:
+        app.add_middleware(ProfilingMiddleware, profiler=profiler, sample_rate=profiling_settings.request_sample_rate)
+
+    redis_settings = RedisSettings()
+    app.state.redis = None
+
+    async def get_shared_redis() -> 'Redis':
+        return app.state.redis
+
+    websocket_settings = WebSocketSettings()
+    price_hub = PriceHub(
+        redis_factory=get_shared_redis,
+        send_queue_size=websocket_settings.send_queue_size,
+        overflow_policy=websocket_settings.overflow_policy,
+    )
+    app.state.price_hub = price_hub
+    metrics.instrument_price_hub(price_hub)
+    metrics.instrument_pools(lambda: app.state.redis)
+
+    app.state.price_streams = redis_settings.create_price_streams()
+    app.state.recent_prices = redis_settings.create_recent_prices()
+    latest_prices = LatestPrices()
+    app.state.latest_prices = latest_prices
+    price_hub.add_channel_handler(redis_settings.board_channel, latest_prices.update_from_message)
+    ticker_index = TickerIndex()
+    app.state.ticker_index = ticker_index
+    price_hub.add_channel_handler(redis_settings.tickers_channel, ticker_index.update_from_message)
+
+    def create_pools() -> None:
+        # one engine and one redis pool per worker process, shared by every request
+        DBSettings().setup()
+        app.state.redis = redis_settings.create_redis()
+
+    async def start_price_feed() -> None:
+        await price_hub.start()
+        latest_prices.warm(await load_latest_prices())
+        ticker_index.load(await load_ticker_names())
+
+    app.add_event_handler('startup', create_pools)
+    app.add_event_handler('startup', start_price_feed)
+    # the hub closes the shared redis pool as its last user
+    app.add_event_handler('shutdown', price_hub.stop)
+    app.add_event_handler('shutdown', db.dispose_async_engine)
+
     app.mount('/static', StaticFiles(directory=static_directory), name='static')
 
     app.get('/')(home)
+    app.get('/tickers')(get_tickers)
     app.get('/ticker-price')(get_ticker_price)
+    app.get('/ticker-candles')(get_ticker_candles)
+    app.get('/ticker-prices/latest')(get_latest_prices)
+    app.get('/metrics')(get_metrics)
     app.websocket('/track-price')(ticker_price)
 
     return app
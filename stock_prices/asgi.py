@@ -1,6 +1,5 @@
 from stock_prices.app import get_app
-from stock_prices.settings import DBSettings, LoggingSetting
+from stock_prices.settings import LoggingSetting
 
 LoggingSetting().setup()
-DBSettings().setup()
 app = get_app()
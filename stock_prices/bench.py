@@ -0,0 +1,186 @@
+import asyncio
+import contextlib
+import json
+import socket
+import time
+import urllib.request
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+from urllib.parse import urlencode
+
+import uvicorn
+from fastapi.encoders import jsonable_encoder
+from websockets.client import connect
+
+from stock_prices.app import get_app
+from stock_prices.hub import OverflowPolicy, PriceHub, SendQueue
+from stock_prices.models import RedisPriceMessage, TickerPrice
+
+_SERVER_START_TIMEOUT = 10.0
+_DELIVERY_DRAIN_TIME = 1.0
+
+
+def _sample_messages(tickers: int) -> list[dict[str, Any]]:
+    created_at = datetime.now(timezone.utc)
+    return [
+        {
+            'type': 'message',
+            'channel': f'ticker_{i:02}',
+            'data': json.dumps(TickerPrice(name=f'ticker_{i:02}', price=Decimal(i), created_at=created_at).encoded()),
+        }
+        for i in range(tickers)
+    ]
+
+
+def _reencode_messages(messages: list[dict[str, Any]], subscribers: int) -> None:
+    # the path used before forwarding raw messages: parse and validate, then encode for every websocket
+    for raw_message in messages:
+        payload = RedisPriceMessage.parse_obj(raw_message).payload
+        for _ in range(subscribers):
+            json.dumps(jsonable_encoder(payload))
+
+
+def _forward_messages(messages: list[dict[str, Any]], subscribers: int) -> None:
+    hub = PriceHub(redis_factory=None)  # type: ignore[arg-type]
+    queues = [SendQueue(maxsize=len(messages), overflow_policy=OverflowPolicy.CONFLATE) for _ in range(subscribers)]
+    for raw_message in messages:
+        hub._subscribers.setdefault(raw_message['channel'], set()).update(queues)
+
+    for raw_message in messages:
+        hub._dispatch(raw_message)
+    for queue in queues:
+        f'[{",".join(update for _, update in queue.drain())}]'
+
+
+def _messages_per_second(run: Callable[[list[dict[str, Any]], int], None], tickers: int, subscribers: int) -> float:
+    messages = _sample_messages(tickers)
+    start_time = time.process_time()
+    run(messages, subscribers)
+    return tickers / max(time.process_time() - start_time, 1e-9)
+
+
+async def bench_dispatch(tickers: int, subscribers: int) -> dict[str, float]:
+    return {
+        'reencode': _messages_per_second(_reencode_messages, tickers, subscribers),
+        'raw': _messages_per_second(_forward_messages, tickers, subscribers),
+    }
+
+
+async def bench_load(
+    tick: Callable[[], Awaitable[int]],
+    ticker_names: list[str],
+    clients: int,
+    rate: float,
+    duration: float,
+    url: Optional[str] = None,
+) -> dict[str, Any]:
+    async with contextlib.AsyncExitStack() as stack:
+        if url is None:
+            base_url: str = await stack.enter_async_context(_serve_in_process())
+        else:
+            base_url = url
+        connections = [
+            await stack.enter_async_context(connect(f'ws{base_url.removeprefix("http")}/track-price'))
+            for _ in range(clients)
+        ]
+        lags: list[float] = []
+        for connection in connections:
+            await connection.send(json.dumps({'action': 'subscribe', 'tickers': ticker_names}))
+        receivers = [asyncio.create_task(_receive_prices(connection, lags)) for connection in connections]
+
+        started_at = time.monotonic()
+        deadline = started_at + duration
+        (tick_durations, prices), history_latencies = await asyncio.gather(
+            _drive_generator(tick, rate, deadline), _query_history(base_url, ticker_names, deadline)
+        )
+        elapsed = time.monotonic() - started_at
+        await asyncio.sleep(_DELIVERY_DRAIN_TIME)
+        for receiver in receivers:
+            receiver.cancel()
+
+    return {
+        'config': {'tickers': len(ticker_names), 'clients': clients, 'rate': rate, 'duration': duration},
+        'generator': {
+            'ticks_per_second': len(tick_durations) / elapsed,
+            'prices_per_second': prices / elapsed,
+            'tick_p50': _percentile(tick_durations, 0.5),
+            'tick_p99': _percentile(tick_durations, 0.99),
+        },
+        'history': {
+            'requests': len(history_latencies),
+            'p50': _percentile(history_latencies, 0.5),
+            'p99': _percentile(history_latencies, 0.99),
+        },
+        'delivery_lag': {
+            'messages': len(lags),
+            'p50': _percentile(lags, 0.5),
+            'p99': _percentile(lags, 0.99),
+            'max': max(lags, default=None),
+        },
+    }
+
+
+@contextlib.asynccontextmanager
+async def _serve_in_process() -> AsyncIterator[str]:
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        port = free_socket.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(get_app(), host='127.0.0.1', port=port, log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT
+    while not server.started:
+        if serving.done() or time.monotonic() > deadline:
+            raise RuntimeError('Benchmark server has not started')
+        await asyncio.sleep(0.05)
+    try:
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        server.should_exit = True
+        await serving
+
+
+async def _drive_generator(
+    tick: Callable[[], Awaitable[int]], rate: float, deadline: float
+) -> tuple[list[float], int]:
+    durations: list[float] = []
+    prices = 0
+    while time.monotonic() < deadline:
+        start_time = time.monotonic()
+        prices += await tick()
+        durations.append(time.monotonic() - start_time)
+        await asyncio.sleep(max(1 / rate - durations[-1], 0))
+    return durations, prices
+
+
+async def _query_history(url: str, ticker_names: list[str], deadline: float) -> list[float]:
+    latencies: list[float] = []
+    while time.monotonic() < deadline:
+        ticker_url = (
+            f'{url}/ticker-price?{urlencode({"ticker_name": ticker_names[len(latencies) % len(ticker_names)]})}'
+        )
+        start_time = time.monotonic()
+        # urllib is blocking, the thread keeps it from stalling the in-process server
+        await asyncio.to_thread(_read_url, ticker_url)
+        latencies.append(time.monotonic() - start_time)
+    return latencies
+
+
+def _read_url(url: str) -> bytes:
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+async def _receive_prices(connection: Any, lags: list[float]) -> None:
+    async for frame in connection:
+        received_at = time.time()
+        lags.extend(
+            received_at - datetime.fromisoformat(price['created_at']).timestamp() for price in json.loads(frame)
+        )
+
+
+def _percentile(values: list[float], quantile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(quantile * len(ordered)), len(ordered) - 1)]
@@ -1,68 +1,519 @@
 import asyncio
+import contextlib
 import json
+import math
+import multiprocessing
+import queue
+import re
 import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
 from random import random
-from typing import Callable
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, NamedTuple, Optional, Sequence, Union
 
-import sqlalchemy.orm as so
+import sqlalchemy as sa
 import typer
+from prometheus_client import start_http_server
+from sqlalchemy.dialects import postgresql as pg
 
 import stock_prices.settings
-from stock_prices import db
-from stock_prices.models import TickerPrice
+from stock_prices import bench, db, history, metrics, partitions
+from stock_prices.models import CandleResolution, StoredTickerPrice, TickerPrice
+from stock_prices.scheduler import TickerScheduler, Tier
 from stock_prices.views import get_redis
 
+if TYPE_CHECKING:
+    from aioredis import Redis
+    from sqlalchemy.dialects.postgresql import Insert
+    from sqlalchemy.sql import ColumnElement, Select
+    from sqlalchemy.sql.functions import Function
+
+    from stock_prices.recent_prices import RecentPrices
+    from stock_prices.streams import PriceStreams
+
 app = typer.Typer()
 
+_SUPERVISOR_POLL_INTERVAL = 1.0
+_SUPERVISOR_REPORT_INTERVAL = 10.0
+_TICKERS_SYNC_INTERVAL = 10.0
+
+
+class Shard(NamedTuple):
+    number: int
+    total: int
+
+
+ALL_TICKERS = Shard(number=0, total=1)
+
 
 @app.command()
-def generate_prices(interval: float = 1.0) -> None:
+def generate_prices(
+    interval: float = typer.Option(1.0, help='Seconds between updates of tickers not matching any --tier'),
+    tier: list[str] = typer.Option(
+        [],
+        help='Update tickers with names fully matching a regex every given seconds, as REGEX=SECONDS; '
+        'the first matching tier wins',
+    ),
+    workers: int = typer.Option(1, min=1, help='Worker processes, each updating its own share of tickers'),
+    shard: Optional[str] = typer.Option(
+        None, help='Update only the i-th of N shards of tickers, as i/N; all machines must use the same --workers'
+    ),
+    metrics_port: Optional[int] = typer.Option(
+        None, help='Export prometheus metrics on this port, workers use the following ports one by one'
+    ),
+) -> None:
+    machine_shard = _parse_shard(shard) if shard else ALL_TICKERS
+    tiers = [_parse_tier(value) for value in tier]
+    if workers == 1:
+        _run_worker(interval, machine_shard, metrics_port=metrics_port, tiers=tiers)
+        return
+
+    _supervise_workers(
+        interval,
+        [Shard(machine_shard.number * workers + i, machine_shard.total * workers) for i in range(workers)],
+        metrics_port=metrics_port,
+        tiers=tiers,
+    )
+
+
+def _parse_shard(value: str) -> Shard:
+    try:
+        number, total = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise typer.BadParameter(f'Shard must look like i/N, got {value!r}')
+    if not 0 <= number < total:
+        raise typer.BadParameter(f'Shard number must be in [0, {total}), got {number}')
+    return Shard(number, total)
+
+
+def _parse_tier(value: str) -> Tier:
+    pattern, _, seconds = value.rpartition('=')
+    try:
+        re.compile(pattern)
+        interval = float(seconds)
+    except (re.error, ValueError):
+        raise typer.BadParameter(f'Tier must look like REGEX=SECONDS, got {value!r}')
+    if not pattern or interval <= 0:
+        raise typer.BadParameter(f'Tier must have a regex and a positive interval, got {value!r}')
+    return Tier(pattern, interval)
+
+
+def _run_worker(
+    interval: float,
+    shard: Shard,
+    ticks: Optional['multiprocessing.Queue[int]'] = None,
+    metrics_port: Optional[int] = None,
+    tiers: Optional[list[Tier]] = None,
+) -> None:
     stock_prices.settings.DBSettings().setup()
+    if metrics_port is not None:
+        start_http_server(metrics_port)
+    report: Callable[..., None] = _report_tick
+    if ticks is not None:
+        report = partial(_queue_tick, ticks)
+    asyncio.run(_generate_prices(interval, shard, report=report, tiers=tiers))
 
-    while True:
-        start_time = time.monotonic()
-        _update_prices(price_diff_generator=generate_movement)
-        typer.secho('Prices have been Generated')
-        to_sleep = interval - (time.monotonic() - start_time)
-        if to_sleep > 0:
-            time.sleep(to_sleep)
+
+def _supervise_workers(
+    interval: float, shards: list[Shard], metrics_port: Optional[int] = None, tiers: Optional[list[Tier]] = None
+) -> None:
+    context = multiprocessing.get_context('spawn')
+    ticks: 'multiprocessing.Queue[int]' = context.Queue()
+    processes: dict[Shard, multiprocessing.process.BaseProcess] = {}
+
+    def start_worker(shard: Shard) -> None:
+        worker_metrics_port = None if metrics_port is None else metrics_port + shards.index(shard)
+        processes[shard] = context.Process(  # type: ignore[attr-defined]
+            target=_run_worker,
+            args=(interval, shard, ticks, worker_metrics_port, tiers),
+            name=f'generate-prices-{shard.number}-of-{shard.total}',
+        )
+        processes[shard].start()
+
+    for shard in shards:
+        start_worker(shard)
+
+    ticks_count = prices_count = 0
+    reported_time = time.monotonic()
+    try:
+        while True:
+            try:
+                prices_count += ticks.get(timeout=_SUPERVISOR_POLL_INTERVAL)
+                ticks_count += 1
+            except queue.Empty:
+                pass
+
+            for shard, process in processes.items():
+                if not process.is_alive():
+                    typer.secho(
+                        f'Worker for shard {shard.number}/{shard.total} exited with {process.exitcode}, restart it',
+                        fg=typer.colors.RED,
+                    )
+                    start_worker(shard)
+
+            elapsed = time.monotonic() - reported_time
+            if elapsed >= _SUPERVISOR_REPORT_INTERVAL:
+                typer.secho(
+                    f'{len(processes)} workers: {ticks_count / elapsed:.2f} ticks/s, '
+                    f'{prices_count / elapsed:.0f} prices/s'
+                )
+                ticks_count = prices_count = 0
+                reported_time = time.monotonic()
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
 
 
-def _update_prices(price_diff_generator: Callable[[], int], publish: bool = True) -> None:
+def _queue_tick(ticks: 'multiprocessing.Queue[int]', prices_count: int, **_: float) -> None:
+    ticks.put(prices_count)
+
+
+async def _generate_prices(
+    interval: float,
+    shard: Shard = ALL_TICKERS,
+    report: Optional[Callable[..., None]] = None,
+    tiers: Optional[list[Tier]] = None,
+) -> None:
+    report = report or _report_tick
+    redis_settings = stock_prices.settings.RedisSettings()
+    board_channel = redis_settings.board_channel
+    streams = redis_settings.create_price_streams()
+    recent_prices = redis_settings.create_recent_prices()
+    profiling_settings = stock_prices.settings.ProfilingSettings()
+    profiling_settings.setup()
+    profiler = profiling_settings.create_profiler()
+    tick_hook: Callable[[], ContextManager[None]] = contextlib.nullcontext
+    if profiler is not None:
+        tick_hook = partial(profiler.every, profiling_settings.tick_every, f'tick-{shard.number}-of-{shard.total}')
+    redis = await get_redis()
+    async with redis:
+        if recent_prices is not None:
+            # prices may have been generated while the buffers were not updated, e.g. by a previous worker
+            await _warm_recent_prices(redis, recent_prices, shard)
+        scheduler = TickerScheduler(interval, tiers)
+        synced_at = -math.inf
+        while True:
+            start_time = time.monotonic()
+            if start_time - synced_at >= _TICKERS_SYNC_INTERVAL:
+                with db.create_session() as session:
+                    scheduler.sync(session.execute(_select_tickers(shard)).all(), now=start_time)
+                synced_at = start_time
+
+            due = scheduler.pop_due(start_time)
+            if due.ticker_ids:
+                prices = _update_prices(
+                    price_diff_generator=generate_movement, shard=shard, tick_hook=tick_hook, ticker_ids=due.ticker_ids
+                )
+                updated_time = time.monotonic()
+                await _publish(
+                    redis, prices, board_channel=board_channel, streams=streams, recent_prices=recent_prices
+                )
+                finish_time = time.monotonic()
+
+                _observe_tick(
+                    update_duration=updated_time - start_time,
+                    publish_duration=finish_time - updated_time,
+                    interval=scheduler.shortest_interval,
+                    missed=due.missed,
+                )
+                report(
+                    prices_count=len(prices),
+                    update_duration=updated_time - start_time,
+                    publish_duration=finish_time - updated_time,
+                    interval=scheduler.shortest_interval,
+                )
+
+            # a batch of every ticker due by the wakeup is updated at once
+            next_due_at = scheduler.next_due_at()
+            wake_at = synced_at + _TICKERS_SYNC_INTERVAL
+            if next_due_at is not None:
+                wake_at = min(wake_at, next_due_at)
+            await asyncio.sleep(max(wake_at - time.monotonic(), 0))
+
+
+async def _warm_recent_prices(redis: 'Redis', recent_prices: 'RecentPrices', shard: Shard = ALL_TICKERS) -> None:
     with db.create_session() as session:
-        tickers: list[db.Ticker] = session.query(db.Ticker).options(so.joinedload(db.Ticker.last_price)).all()
+        await recent_prices.warm(redis, session, [row.id for row in session.execute(_select_tickers(shard))])
+
+
+def _select_tickers(shard: Shard = ALL_TICKERS) -> 'Select':
+    query = sa.select(db.Ticker.id, db.Ticker.name)
+    if shard.total > 1:
+        query = query.where(db.Ticker.id % shard.total == shard.number)
+    return query
+
+
+def _observe_tick(update_duration: float, publish_duration: float, interval: float, missed: int = 0) -> None:
+    metrics.MISSED_UPDATES.inc(missed)
+    metrics.DB_WRITE_DURATION.observe(update_duration)
+    metrics.PUBLISH_DURATION.observe(publish_duration)
+    metrics.TICK_DURATION.observe(update_duration + publish_duration)
+    if update_duration + publish_duration > interval:
+        metrics.TICK_OVERRUNS.inc()
+
+
+def _report_tick(prices_count: int, update_duration: float, publish_duration: float, interval: float) -> None:
+    tick_duration = update_duration + publish_duration
+    typer.secho(
+        f'{prices_count} prices have been generated in {tick_duration:.3f}s '
+        f'(db: {update_duration:.3f}s, publish: {publish_duration:.3f}s)',
+        fg=typer.colors.RED if tick_duration > interval else None,
+    )
+
+
+def _update_prices(
+    price_diff_generator: Callable[[], int],
+    shard: Shard = ALL_TICKERS,
+    tick_hook: Callable[[], ContextManager[None]] = contextlib.nullcontext,
+    ticker_ids: Optional[list[int]] = None,
+) -> list[StoredTickerPrice]:
+    with tick_hook(), db.create_session() as session:
+        query = session.query(db.Ticker.id, db.Ticker.name, db.TickerLastPrice.price).outerjoin(
+            db.TickerLastPrice, db.TickerLastPrice.ticker_id == db.Ticker.id
+        )
+        if shard.total > 1:
+            query = query.filter(db.Ticker.id % shard.total == shard.number)
+        if ticker_ids is not None:
+            query = query.filter(db.Ticker.id.in_(ticker_ids))
+        tickers = query.all()
+        if not tickers:
+            return []
+
+        updated_ids, new_prices = [], []
         for ticker in tickers:
             new_price = 0
-            if last_price := ticker.last_price:
-                new_price = last_price.price + price_diff_generator()
-            new_ticker_price = db.TickerPrice(ticker=ticker, price=new_price)
-            session.add(new_ticker_price)
-            session.flush()
-
-            if publish:
-                price_message = TickerPrice(
-                    name=ticker.name,
-                    price=new_price,
-                    created_at=new_ticker_price.created_at,
-                )
-                asyncio.run(_publish(ticker.name, price_message))
+            if ticker.price is not None:
+                new_price = ticker.price + price_diff_generator()
+            updated_ids.append(ticker.id)
+            new_prices.append(new_price)
+
+        inserted = session.execute(_build_prices_insert(), {'ticker_ids': updated_ids, 'prices': new_prices})
+
+        ticker_names = {ticker.id: ticker.name for ticker in tickers}
+        return [
+            StoredTickerPrice(id=row.id, name=ticker_names[row.ticker_id], price=row.price, created_at=row.created_at)
+            for row in inserted
+        ]
+
+
+def _build_prices_insert() -> 'Select':
+    new_prices = sa.select(
+        sa.func.unnest(sa.bindparam('ticker_ids', type_=pg.ARRAY(db.PK_TYPE))).label('ticker_id'),
+        sa.func.unnest(sa.bindparam('prices', type_=pg.ARRAY(db.PRICE_TYPE))).label('price'),
+    )
+    # plain table instead of the mapped class: ORM-enabled selects drop CTEs attached with add_cte()
+    prices_table = db.TickerPrice.__table__
+    inserted = (
+        sa.insert(prices_table)
+        .from_select(['ticker_id', 'price'], new_prices)
+        .returning(prices_table.c.id, prices_table.c.ticker_id, prices_table.c.price, prices_table.c.created_at)
+        .cte('inserted')
+    )
+
+    last_prices = pg.insert(db.TickerLastPrice).from_select(
+        ['ticker_id', 'price_id', 'price', 'created_at'],
+        sa.select(inserted.c.ticker_id, inserted.c.id, inserted.c.price, inserted.c.created_at),
+    )
+    last_prices = last_prices.on_conflict_do_update(
+        index_elements=[db.TickerLastPrice.ticker_id],
+        set_={column: getattr(last_prices.excluded, column) for column in ('price_id', 'price', 'created_at')},
+    )
+
+    resolutions = sa.values(sa.column('seconds', sa.Integer), name='resolutions').data(
+        [(resolution.seconds,) for resolution in CandleResolution]
+    )
+    candles = pg.insert(db.TickerCandle).from_select(
+        ['ticker_id', 'resolution', 'started_at', 'open', 'high', 'low', 'close'],
+        sa.select(
+            inserted.c.ticker_id,
+            resolutions.c.seconds,
+            _candle_started_at(inserted.c.created_at, resolutions.c.seconds),
+            *[inserted.c.price] * 4,
+        ).join_from(inserted, resolutions, sa.true()),
+    )
+    candles = candles.on_conflict_do_update(
+        index_elements=[db.TickerCandle.ticker_id, db.TickerCandle.resolution, db.TickerCandle.started_at],
+        set_={
+            'high': sa.func.greatest(db.TickerCandle.high, candles.excluded.high),
+            'low': sa.func.least(db.TickerCandle.low, candles.excluded.low),
+            'close': candles.excluded.close,
+        },
+    )
+
+    return sa.select(inserted).add_cte(last_prices.cte('last_prices')).add_cte(candles.cte('candles'))
+
+
+def _candle_started_at(created_at: 'ColumnElement[Any]', seconds: Union[int, 'ColumnElement[Any]']) -> 'Function[Any]':
+    return sa.func.to_timestamp(sa.func.floor(sa.extract('epoch', created_at) / seconds) * seconds)
 
 
 def generate_movement() -> int:
     return -1 if random() < 0.5 else 1
 
 
-async def _publish(ticker_name: str, price_message: TickerPrice) -> None:
+async def _publish(
+    redis: 'Redis',
+    prices: Sequence[TickerPrice],
+    board_channel: Optional[str] = None,
+    streams: Optional['PriceStreams'] = None,
+    recent_prices: Optional['RecentPrices'] = None,
+) -> None:
+    if not prices:
+        return
+
+    messages = [json.dumps(price.encoded()) for price in prices]
+    if streams is not None:
+        messages = await streams.add(redis, [(price.name, message) for price, message in zip(prices, messages)])
+    async with redis.pipeline(transaction=False) as pipe:
+        for price, message in zip(prices, messages):
+            pipe.publish(price.name, message)
+        if board_channel:
+            pipe.publish(board_channel, f'[{",".join(messages)}]')
+        if recent_prices is not None:
+            # only prices stored in the database have ids to be served by
+            recent_prices.add(pipe, [price for price in prices if isinstance(price, StoredTickerPrice)])
+        await pipe.execute()
+
+
+@app.command()
+def backfill_candles() -> None:
+    stock_prices.settings.DBSettings().setup()
+
+    with db.create_session() as session:
+        for resolution in CandleResolution:
+            result = session.execute(_build_candles_backfill(resolution))
+            typer.secho(f'{result.rowcount} {resolution.value} candles have been backfilled')
+
+
+def _build_candles_backfill(resolution: CandleResolution) -> 'Insert':
+    price = db.TickerPrice.price
+    started_at = _candle_started_at(db.TickerPrice.created_at, resolution.seconds).label('started_at')
+    price_array = pg.ARRAY(db.PRICE_TYPE)
+    candles = (
+        sa.select(
+            db.TickerPrice.ticker_id,
+            sa.literal(resolution.seconds).label('resolution'),
+            started_at,
+            sa.func.array_agg(pg.aggregate_order_by(price, db.TickerPrice.id.asc()), type_=price_array)[1],
+            sa.func.max(price),
+            sa.func.min(price),
+            sa.func.array_agg(pg.aggregate_order_by(price, db.TickerPrice.id.desc()), type_=price_array)[1],
+        )
+        .where(price.isnot(None))
+        .group_by(db.TickerPrice.ticker_id, started_at)
+    )
+
+    insert = pg.insert(db.TickerCandle).from_select(
+        ['ticker_id', 'resolution', 'started_at', 'open', 'high', 'low', 'close'], candles
+    )
+    return insert.on_conflict_do_update(
+        index_elements=[db.TickerCandle.ticker_id, db.TickerCandle.resolution, db.TickerCandle.started_at],
+        set_={column: getattr(insert.excluded, column) for column in ('open', 'high', 'low', 'close')},
+    )
+
+
+@app.command()
+def manage_partitions() -> None:
+    stock_prices.settings.DBSettings().setup()
+    settings = stock_prices.settings.PartitionSettings()
+    today = datetime.now(timezone.utc).date()
+
+    with db.create_session() as session:
+        created = partitions.create_partitions(session, first_day=today, days=settings.premake_days + 1)
+        retired = partitions.retire_partitions(
+            session, before=today - timedelta(days=settings.retention_days), archive_schema=settings.archive_schema
+        )
+    typer.secho(f'{len(created)} partitions have been created, {len(retired)} partitions have been retired')
+
+
+@app.command()
+def bench_dispatch(tickers: int = 1000, subscribers: int = 10) -> None:
+    for path, rate in asyncio.run(bench.bench_dispatch(tickers=tickers, subscribers=subscribers)).items():
+        typer.secho(f'{path}: {rate:.0f} messages/s per core for {subscribers} subscribers')
+
+
+@app.command(name='bench')
+def run_bench(
+    tickers: int = typer.Option(10, min=1, help='Tickers to create and track by every client'),
+    clients: int = typer.Option(10, min=1, help='Websocket clients'),
+    rate: float = typer.Option(10.0, min=0.01, help='Target generator ticks per second'),
+    duration: float = typer.Option(10.0, min=0.1, help='Seconds to run the load for'),
+    url: Optional[str] = typer.Option(
+        None, help='Server to load, e.g. http://localhost:8000; by default one is started in this process'
+    ),
+) -> None:
+    stock_prices.settings.DBSettings().setup()
+    names = [f'bench_{i:04}' for i in range(tickers)]
+    with db.create_session() as session:
+        session.execute(pg.insert(db.Ticker).values([{'name': name} for name in names]).on_conflict_do_nothing())
+
+    results = asyncio.run(_bench(names, clients=clients, rate=rate, duration=duration, url=url))
+    typer.secho(json.dumps(results, indent=2))
+
+
+async def _bench(ticker_names: list[str], clients: int, rate: float, duration: float, url: Optional[str]) -> Any:
+    redis_settings = stock_prices.settings.RedisSettings()
+    streams = redis_settings.create_price_streams()
+    recent_prices = redis_settings.create_recent_prices()
     redis = await get_redis()
-    message = json.dumps(price_message.encoded())
-    await redis.publish(ticker_name, message)
+
+    async def tick() -> int:
+        # like the generator, which ticks every ticker of the database and not only the benchmark ones
+        prices = await asyncio.to_thread(_update_prices, generate_movement)
+        await _publish(
+            redis, prices, board_channel=redis_settings.board_channel, streams=streams, recent_prices=recent_prices
+        )
+        return len(prices)
+
+    async with redis:
+        return await bench.bench_load(tick, ticker_names, clients=clients, rate=rate, duration=duration, url=url)
 
 
 @app.command()
-def fill_db(amount: int = 100) -> None:
+def fill_db(
+    tickers: int = typer.Option(100, min=0, help='Tickers to create, named ticker_00, ticker_01 and so on'),
+    history_days: float = typer.Option(0.0, min=0.0, help='Days of random walk price history to generate'),
+    tick_interval: float = typer.Option(1.0, min=0.001, help='Seconds between generated prices'),
+) -> None:
     stock_prices.settings.DBSettings().setup()
+    finished_at = datetime.now(timezone.utc)
+    started_at = finished_at - timedelta(days=history_days)
+    ticks = int(history_days * 24 * 60 * 60 / tick_interval)
+    names = [f'ticker_{str(i).rjust(2, "0")}' for i in range(tickers)]
+    if not names:
+        return
+
+    with db.create_session() as session:
+        new_names = (
+            session.execute(
+                pg.insert(db.Ticker)
+                .values([{'name': name} for name in names])
+                .on_conflict_do_nothing()
+                .returning(db.Ticker.name)
+            )
+            .scalars()
+            .all()
+        )
+        ticker_ids = session.execute(sa.select(db.Ticker.id).where(db.Ticker.name.in_(names))).scalars().all()
+    if new_names:
+        asyncio.run(_announce_tickers(new_names))
+    if not ticks:
+        return
 
     with db.create_session() as session:
-        for i in range(amount):
-            ticker_num = str(i).rjust(2, '0')
-            session.add(db.Ticker(name=f'ticker_{ticker_num}'))
+        partitions.create_partitions(
+            session, first_day=started_at.date(), days=(finished_at.date() - started_at.date()).days + 1
+        )
+        start_time = time.monotonic()
+        rows = history.fill_history(
+            session, ticker_ids, started_at=started_at, ticks=ticks, tick_interval=timedelta(seconds=tick_interval)
+        )
+    typer.secho(f'{rows} prices have been generated in {time.monotonic() - start_time:.1f}s')
+
+
+async def _announce_tickers(names: list[str]) -> None:
+    redis = await get_redis()
+    async with redis:
+        await redis.publish(stock_prices.settings.RedisSettings().tickers_channel, json.dumps(names))
@@ -0,0 +1,38 @@
+from typing import Callable, Sequence, TypeVar
+
+T = TypeVar('T')
+
+
+def largest_triangle_three_buckets(
+    points: Sequence[T], threshold: int, x: Callable[[T], float], y: Callable[[T], float]
+) -> list[T]:
+    if threshold < 3 or len(points) <= threshold:
+        return list(points)
+
+    xs = [x(point) for point in points]
+    ys = [y(point) for point in points]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+
+    sampled = [points[0]]
+    selected = 0
+    for bucket in range(threshold - 2):
+        bucket_start = int(bucket * bucket_size) + 1
+        bucket_end = int((bucket + 1) * bucket_size) + 1
+        next_bucket_end = min(int((bucket + 2) * bucket_size) + 1, len(points))
+
+        next_bucket_length = next_bucket_end - bucket_end
+        avg_x = sum(xs[bucket_end:next_bucket_end]) / next_bucket_length
+        avg_y = sum(ys[bucket_end:next_bucket_end]) / next_bucket_length
+
+        selected_x, selected_y = xs[selected], ys[selected]
+        max_area, max_area_point = -1.0, bucket_start
+        for i in range(bucket_start, bucket_end):
+            area = abs((selected_x - avg_x) * (ys[i] - selected_y) - (selected_x - xs[i]) * (avg_y - selected_y))
+            if area > max_area:
+                max_area, max_area_point = area, i
+
+        sampled.append(points[max_area_point])
+        selected = max_area_point
+
+    sampled.append(points[-1])
+    return sampled
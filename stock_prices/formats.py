@@ -0,0 +1,103 @@
+import enum
+import json
+import struct
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Optional, Sequence, Union
+
+# epoch milliseconds and price, None when the price is unknown
+Point = tuple[int, Optional[float]]
+
+
+class WireFormat(str, enum.Enum):
+    JSON = 'json'
+    COLUMNAR = 'columnar'
+    PACKED = 'packed'
+
+    @property
+    def media_type(self) -> str:
+        return {
+            'json': 'application/json',
+            'columnar': 'application/vnd.stock-prices.columnar+json',
+            'packed': 'application/vnd.stock-prices.packed',
+        }[self.value]
+
+    @property
+    def subprotocol(self) -> str:
+        return f'prices.{self.value}'
+
+
+def negotiate_media_type(accept: Optional[str]) -> WireFormat:
+    for wire_format in (WireFormat.PACKED, WireFormat.COLUMNAR):
+        if accept and wire_format.media_type in accept:
+            return wire_format
+    return WireFormat.JSON
+
+
+def negotiate_subprotocol(subprotocols: Sequence[str]) -> Optional[WireFormat]:
+    for subprotocol in subprotocols:
+        for wire_format in WireFormat:
+            if subprotocol == wire_format.subprotocol:
+                return wire_format
+    return None
+
+
+def epoch_ms(created_at: datetime) -> int:
+    return round(created_at.timestamp() * 1000)
+
+
+def encode_series(wire_format: WireFormat, name: str, points: list[Point]) -> bytes:
+    if wire_format is WireFormat.PACKED:
+        return _pack_series(name, points)
+    return json.dumps(_columnar(name, points), separators=(',', ':')).encode()
+
+
+def encode_messages(wire_format: WireFormat, messages: list[str]) -> Union[str, bytes]:
+    if wire_format is WireFormat.JSON:
+        return f'[{",".join(messages)}]'
+
+    series: dict[str, list[Point]] = {}
+    last_ids: dict[str, str] = {}
+    for message in messages:
+        name, point, stream_id = _parse_message(message)
+        series.setdefault(name, []).append(point)
+        if stream_id is not None:
+            last_ids[name] = stream_id
+
+    if wire_format is WireFormat.PACKED:
+        return b''.join(_pack_series(name, points) for name, points in series.items())
+    return json.dumps(
+        [
+            {**_columnar(name, points), **({'last_id': last_ids[name]} if name in last_ids else {})}
+            for name, points in series.items()
+        ],
+        separators=(',', ':'),
+    )
+
+
+def created_at_ms(message: str) -> int:
+    return _parse_message(message)[1][0]
+
+
+# the same message is sent to every subscriber of a ticker, so it is parsed once for all of them
+@lru_cache(maxsize=4096)
+def _parse_message(message: str) -> tuple[str, Point, Optional[str]]:
+    price = json.loads(message)
+    return price['name'], (epoch_ms(datetime.fromisoformat(price['created_at'])), price['price']), price.get('id')
+
+
+def _columnar(name: str, points: list[Point]) -> dict[str, Any]:
+    return {'name': name, 't': [t for t, _ in points], 'p': [p for _, p in points]}
+
+
+def _pack_series(name: str, points: list[Point]) -> bytes:
+    # little endian: u16 name length, name, u32 count, int64 epoch ms * count, float64 price * count (NaN if unknown)
+    encoded_name = name.encode()
+    return struct.pack(
+        f'<H{len(encoded_name)}sI{len(points)}q{len(points)}d',
+        len(encoded_name),
+        encoded_name,
+        len(points),
+        *(t for t, _ in points),
+        *(float('nan') if p is None else p for _, p in points),
+    )
@@ -0,0 +1,78 @@
+import io
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy.dialects import postgresql as pg
+
+from stock_prices import db
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 500_000
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_COPY_PRICES = 'COPY ticker_price (ticker_id, created_at, price) FROM STDIN'
+
+
+def fill_history(
+    session: so.Session,
+    ticker_ids: list[int],
+    started_at: datetime,
+    ticks: int,
+    tick_interval: timedelta,
+    chunk_size: int = COPY_CHUNK_SIZE,
+    rng: Optional[np.random.Generator] = None,
+) -> int:
+    rng = rng or np.random.default_rng()
+    tickers_per_chunk = max(min(len(ticker_ids), chunk_size), 1)
+    ticks_per_chunk = max(chunk_size // tickers_per_chunk, 1)
+    interval = np.timedelta64(tick_interval // timedelta(microseconds=1), 'us')
+    first_tick = np.datetime64((started_at - _EPOCH) // timedelta(microseconds=1), 'us')
+    cursor = session.connection().connection.cursor()
+    last_prices = np.zeros(len(ticker_ids), dtype=np.int64)
+
+    # rows are written in time order like the generator writes them, which keeps the created_at BRIN index selective
+    for tick in range(0, ticks, ticks_per_chunk):
+        size = min(ticks_per_chunk, ticks - tick)
+        created_at = np.datetime_as_string(first_tick + (tick + np.arange(size)) * interval, unit='us')
+        for batch_start in range(0, len(ticker_ids), tickers_per_chunk):
+            batch = ticker_ids[batch_start : batch_start + tickers_per_chunk]
+            prices = last_prices[batch_start : batch_start + len(batch)]
+            # the same +-1 movement as `generate_movement`, accumulated from the last price of the previous chunk
+            walks = prices[:, None] + np.cumsum(np.where(rng.random((len(batch), size)) < 0.5, -1, 1), axis=1)
+            prices[:] = walks[:, -1]
+            rows = io.StringIO(
+                ''.join(
+                    f'{ticker_id}\t{t}+00\t{p}\n'
+                    # COPY bypasses the column type, so prices are written in its stored units
+                    for t, moment_prices in zip(created_at, (walks.T * 10**db.PRICE_SCALE).tolist())
+                    for ticker_id, p in zip(batch, moment_prices)
+                )
+            )
+            cursor.copy_expert(_COPY_PRICES, rows)
+        logger.info('%d of %d ticks of history have been generated', tick + size, ticks)
+
+    if ticks:
+        _update_last_prices(session, ticker_ids, last_tick_at=started_at + (ticks - 1) * tick_interval)
+    return len(ticker_ids) * ticks
+
+
+def _update_last_prices(session: so.Session, ticker_ids: list[int], last_tick_at: datetime) -> None:
+    last_prices = (
+        sa.select(db.TickerPrice.ticker_id, db.TickerPrice.id, db.TickerPrice.price, db.TickerPrice.created_at)
+        .where(db.TickerPrice.ticker_id.in_(ticker_ids), db.TickerPrice.created_at >= last_tick_at)
+        .distinct(db.TickerPrice.ticker_id)
+        .order_by(db.TickerPrice.ticker_id, db.TickerPrice.created_at.desc(), db.TickerPrice.id.desc())
+    )
+    insert = pg.insert(db.TickerLastPrice).from_select(['ticker_id', 'price_id', 'price', 'created_at'], last_prices)
+    session.execute(
+        insert.on_conflict_do_update(
+            index_elements=[db.TickerLastPrice.ticker_id],
+            set_={column: getattr(insert.excluded, column) for column in ('price_id', 'price', 'created_at')},
+            where=db.TickerLastPrice.created_at < insert.excluded.created_at,
+        )
+    )
@@ -0,0 +1,253 @@
+import asyncio
+import contextlib
+import enum
+import logging
+from collections import deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional, Union, cast
+
+from aioredis import RedisError
+
+if TYPE_CHECKING:
+    from aioredis import Redis
+    from aioredis.client import PubSub
+
+logger = logging.getLogger(__name__)
+
+_RESUBSCRIBE_DELAY = 1.0
+
+
+class SubscriptionError(enum.Enum):
+    REDIS_UNAVAILABLE = 'redis_unavailable'
+    SLOW_CONSUMER = 'slow_consumer'
+
+
+class OverflowPolicy(str, enum.Enum):
+    CONFLATE = 'conflate'
+    DROP_OLDEST = 'drop_oldest'
+    DISCONNECT = 'disconnect'
+
+
+# price messages are validated by the producer and forwarded to websockets as published
+PriceUpdate = str
+
+
+class SendQueue:
+    def __init__(self, maxsize: int, overflow_policy: OverflowPolicy) -> None:
+        self._maxsize = maxsize
+        self._overflow_policy = overflow_policy
+        self._updates: deque[tuple[str, PriceUpdate]] = deque()
+        self._error: Optional[SubscriptionError] = None
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._updates)
+
+    def put(self, ticker_name: str, update: PriceUpdate) -> None:
+        if self._error:
+            return
+
+        if len(self._updates) >= self._maxsize:
+            if self._overflow_policy is OverflowPolicy.DISCONNECT:
+                self._updates.clear()
+                self.fail(SubscriptionError.SLOW_CONSUMER)
+                return
+            if self._overflow_policy is OverflowPolicy.CONFLATE:
+                self._conflate(ticker_name)
+            if len(self._updates) >= self._maxsize:
+                self._updates.popleft()
+
+        self._updates.append((ticker_name, update))
+        self._ready.set()
+
+    def fail(self, error: SubscriptionError) -> None:
+        self._error = self._error or error
+        self._ready.set()
+
+    async def get(self) -> Union[tuple[str, PriceUpdate], SubscriptionError]:
+        await self._ready.wait()
+        if not self._updates:
+            return cast(SubscriptionError, self._error)
+
+        update = self._updates.popleft()
+        if not self._updates and not self._error:
+            self._ready.clear()
+        return update
+
+    def drain(self) -> list[tuple[str, PriceUpdate]]:
+        updates = list(self._updates)
+        self._updates.clear()
+        if not self._error:
+            self._ready.clear()
+        return updates
+
+    def _conflate(self, ticker_name: str) -> None:
+        latest_updates = dict(self._updates)
+        latest_updates.pop(ticker_name, None)
+        self._updates = deque(latest_updates.items())
+
+
+async def _get_message(reader: 'PubSub') -> Optional[dict[str, Any]]:
+    return await reader.get_message(timeout=None)  # type: ignore[arg-type]
+
+
+def _log_listener_failure(listener: 'asyncio.Task[None]') -> None:
+    if not listener.cancelled() and (error := listener.exception()):
+        logger.error('Price updates listener has crashed', exc_info=error)
+
+
+class PriceHub:
+    def __init__(
+        self,
+        redis_factory: Callable[[], Awaitable['Redis']],
+        send_queue_size: int = 100,
+        overflow_policy: OverflowPolicy = OverflowPolicy.CONFLATE,
+    ) -> None:
+        self._redis_factory = redis_factory
+        self._send_queue_size = send_queue_size
+        self._overflow_policy = overflow_policy
+        self._redis: Optional['Redis'] = None
+        self._reader: Optional['PubSub'] = None
+        self._listener: Optional['asyncio.Task[None]'] = None
+        self._has_subscriptions: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._subscribers: dict[str, set[SendQueue]] = {}
+        self._channel_handlers: dict[str, Callable[[str], None]] = {}
+
+    @property
+    def redis(self) -> 'Redis':
+        assert self._redis, 'Price hub is not started'
+        return self._redis
+
+    @property
+    def subscriptions(self) -> dict[str, int]:
+        return {ticker_name: len(queues) for ticker_name, queues in self._subscribers.items()}
+
+    @property
+    def send_queue_depths(self) -> list[int]:
+        return [len(queue) for queue in set().union(*self._subscribers.values())]
+
+    def add_channel_handler(self, channel: str, handler: Callable[[str], None]) -> None:
+        self._channel_handlers[channel] = handler
+
+    async def start(self) -> None:
+        self._redis = await self._redis_factory()
+        self._reader = self._redis.pubsub()
+        self._has_subscriptions = asyncio.Event()
+        self._stopping = False
+        await self._subscribe_channel_handlers()
+        self._listener = asyncio.create_task(self._listen())
+        self._listener.add_done_callback(_log_listener_failure)
+
+    async def stop(self) -> None:
+        # aioredis may swallow a cancellation while reconnecting, so the listener also checks this flag
+        self._stopping = True
+        if self._listener:
+            self._listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._listener
+        if self._reader:
+            await self._reader.reset()
+        if self._redis:
+            await self._redis.close()
+            await self._redis.connection_pool.disconnect()
+        self._subscribers.clear()
+
+    def create_send_queue(self) -> SendQueue:
+        return SendQueue(maxsize=self._send_queue_size, overflow_policy=self._overflow_policy)
+
+    async def subscribe(self, ticker_name: str, queue: SendQueue) -> None:
+        assert self._reader and self._has_subscriptions, 'Price hub is not started'
+        if ticker_name in self._channel_handlers:
+            logger.warning('Refuse to subscribe to internal channel %s', ticker_name)
+            return
+
+        queues = self._subscribers.setdefault(ticker_name, set())
+        queues.add(queue)
+        if len(queues) == 1:
+            logger.info('Subscribe to price updates for %s', ticker_name)
+            try:
+                await self._reader.subscribe(ticker_name)
+            except RedisError:
+                waiting_queues = self._subscribers.pop(ticker_name, set())
+                waiting_queues.discard(queue)
+                for waiting_queue in waiting_queues:
+                    waiting_queue.fail(SubscriptionError.REDIS_UNAVAILABLE)
+                raise
+            self._has_subscriptions.set()
+
+    async def unsubscribe(self, ticker_name: str, queue: SendQueue) -> None:
+        if ticker_name in self._channel_handlers:
+            return
+
+        queues = self._subscribers.get(ticker_name)
+        if queues is None or queue not in queues:
+            return
+
+        queues.remove(queue)
+        if queues:
+            return
+
+        del self._subscribers[ticker_name]
+        if not self._subscribers and not self._channel_handlers and self._has_subscriptions:
+            self._has_subscriptions.clear()
+        if self._reader:
+            logger.info('Unsubscribe from price updates for %s', ticker_name)
+            await self._reader.unsubscribe(ticker_name)
+
+    async def _listen(self) -> None:
+        assert self._reader and self._has_subscriptions
+
+        while not self._stopping:
+            await self._has_subscriptions.wait()
+            try:
+                raw_message = await _get_message(self._reader)
+            except RedisError:
+                logger.exception('Cannot read from redis, drop all price subscriptions')
+                await self._drop_subscriptions()
+                await self._resubscribe_channel_handlers()
+                continue
+
+            if raw_message:
+                self._dispatch(raw_message)
+
+    def _dispatch(self, raw_message: dict[str, Any]) -> None:
+        if raw_message.get('type') != 'message':
+            return
+
+        channel = cast(str, raw_message.get('channel'))
+        if handler := self._channel_handlers.get(channel):
+            try:
+                handler(raw_message['data'])
+            except Exception:
+                logger.exception('Cannot handle message from channel %s', channel)
+            return
+
+        for queue in self._subscribers.get(channel, ()):
+            queue.put(channel, raw_message['data'])
+
+    async def _drop_subscriptions(self) -> None:
+        assert self._reader and self._has_subscriptions
+
+        for queues in self._subscribers.values():
+            for queue in queues:
+                queue.fail(SubscriptionError.REDIS_UNAVAILABLE)
+        self._subscribers.clear()
+        self._has_subscriptions.clear()
+        await self._reader.reset()
+
+    async def _subscribe_channel_handlers(self) -> None:
+        assert self._reader and self._has_subscriptions
+
+        if self._channel_handlers:
+            await self._reader.subscribe(*self._channel_handlers)
+            self._has_subscriptions.set()
+
+    async def _resubscribe_channel_handlers(self) -> None:
+        while not self._stopping:
+            try:
+                await self._subscribe_channel_handlers()
+            except RedisError:
+                logger.exception('Cannot resubscribe to redis, retry in %s seconds', _RESUBSCRIBE_DELAY)
+                await asyncio.sleep(_RESUBSCRIBE_DELAY)
+            else:
+                return
@@ -0,0 +1,65 @@
+import json
+import logging
+from typing import Any, Optional
+
+import sqlalchemy as sa
+
+from stock_prices import db
+from stock_prices.models import TickerPrice
+
+logger = logging.getLogger(__name__)
+
+
+class LatestPrices:
+    def __init__(self) -> None:
+        self._prices: dict[str, dict[str, Any]] = {}
+        self._encoded: Optional[bytes] = None
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def warm(self, prices: dict[str, dict[str, Any]]) -> None:
+        # prices received from the feed while warming up are newer than the database ones
+        self._prices = {**prices, **self._prices}
+        self._encoded = None
+        logger.info('Latest prices cache is warmed up with %d tickers', len(self._prices))
+
+    def update_from_message(self, data: str) -> None:
+        try:
+            prices = json.loads(data)
+        except ValueError:
+            logger.exception('Cannot parse latest prices message')
+            return
+
+        if not isinstance(prices, list) or not all(
+            isinstance(price, dict) and isinstance(price.get('name'), str) for price in prices
+        ):
+            logger.error('Got latest prices message of unexpected shape, skip it')
+            return
+
+        for price in prices:
+            self._prices[price['name']] = price
+        self._encoded = None
+
+    def encoded(self, ticker_names: Optional[list[str]] = None) -> bytes:
+        if ticker_names is not None:
+            prices = [self._prices[name] for name in ticker_names if name in self._prices]
+            return _dumps(prices)
+
+        if self._encoded is None:
+            self._encoded = _dumps(list(self._prices.values()))
+        return self._encoded
+
+
+def _dumps(prices: list[dict[str, Any]]) -> bytes:
+    return json.dumps(prices, separators=(',', ':')).encode()
+
+
+async def load_latest_prices() -> dict[str, dict[str, Any]]:
+    async with db.create_async_session() as session:
+        rows = await session.execute(
+            sa.select(db.Ticker.name, db.TickerLastPrice.price, db.TickerLastPrice.created_at).join(
+                db.TickerLastPrice, db.TickerLastPrice.ticker_id == db.Ticker.id
+            )
+        )
+    return {row.name: TickerPrice(name=row.name, price=row.price, created_at=row.created_at).encoded() for row in rows}
@@ -0,0 +1,78 @@
+import time
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Optional
+
+from aioredis import BlockingConnectionPool
+from prometheus_client import Counter, Gauge, Histogram
+
+from stock_prices import db
+from stock_prices.formats import created_at_ms
+from stock_prices.hub import PriceHub
+
+if TYPE_CHECKING:
+    from aioredis import Redis
+
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TICK_DURATION = Histogram(
+    'stock_prices_tick_duration_seconds', 'Time to generate and publish one tick of prices', buckets=_FAST_BUCKETS
+)
+TICK_OVERRUNS = Counter(
+    'stock_prices_tick_overruns', 'Ticks that took longer than the shortest update interval of tickers'
+)
+MISSED_UPDATES = Counter(
+    'stock_prices_missed_updates', 'Ticker updates skipped because the generator was behind their schedule'
+)
+DB_WRITE_DURATION = Histogram(
+    'stock_prices_db_write_duration_seconds', 'Time to write one tick of prices to the database', buckets=_FAST_BUCKETS
+)
+PUBLISH_DURATION = Histogram(
+    'stock_prices_publish_duration_seconds', 'Time to publish one tick of prices to redis', buckets=_FAST_BUCKETS
+)
+DELIVERY_LAG = Histogram(
+    'stock_prices_delivery_lag_seconds',
+    'Time from a price creation to its sending to a websocket, for the oldest price of every frame',
+    buckets=_FAST_BUCKETS,
+)
+HISTORY_QUERY_DURATION = Histogram(
+    'stock_prices_history_query_duration_seconds', 'Time to query price history', ['mode'], buckets=_FAST_BUCKETS
+)
+ACTIVE_WEBSOCKETS = Gauge('stock_prices_active_websockets', 'Open price tracking websockets')
+SUBSCRIPTIONS = Gauge('stock_prices_subscriptions', 'Tickers the price hub is subscribed to')
+SEND_QUEUE_DEPTH = Gauge('stock_prices_send_queue_depth', 'Updates waiting to be sent to websockets', ['aggregate'])
+DB_POOL_CONNECTIONS = Gauge('stock_prices_db_pool_connections', 'Connections of the async database pool', ['state'])
+REDIS_POOL_CONNECTIONS = Gauge('stock_prices_redis_pool_connections', 'Connections of the redis pool', ['state'])
+
+
+def instrument_price_hub(price_hub: PriceHub) -> None:
+    SUBSCRIPTIONS.set_function(lambda: len(price_hub.subscriptions))
+    SEND_QUEUE_DEPTH.labels('total').set_function(lambda: sum(price_hub.send_queue_depths))
+    SEND_QUEUE_DEPTH.labels('max').set_function(lambda: max(price_hub.send_queue_depths, default=0))
+
+
+def instrument_pools(get_redis: Callable[[], Optional['Redis']]) -> None:
+    # the pools are created on startup of every worker, so they are looked up on every scrape
+    for state in ('size', 'checked_out', 'overflow', 'idle'):
+        DB_POOL_CONNECTIONS.labels(state).set_function(partial(_db_pool_connections, state))
+    for state in ('max', 'in_use'):
+        REDIS_POOL_CONNECTIONS.labels(state).set_function(partial(_redis_pool_connections, get_redis, state))
+
+
+def _db_pool_connections(state: str) -> float:
+    return db.async_pool_stats().get(state, 0)
+
+
+def _redis_pool_connections(get_redis: Callable[[], Optional['Redis']], state: str) -> float:
+    return redis_pool_stats(get_redis()).get(state, 0)
+
+
+def redis_pool_stats(redis: Optional['Redis']) -> dict[str, int]:
+    if redis is None or not isinstance(redis.connection_pool, BlockingConnectionPool):
+        return {}
+    pool = redis.connection_pool
+    # the blocking pool queues a placeholder for every connection it may still open, next to the idle ones
+    return {'max': pool.max_connections, 'in_use': pool.max_connections - pool.pool.qsize()}
+
+
+def observe_delivery_lag(message: str) -> None:
+    DELIVERY_LAG.observe(max(time.time() - created_at_ms(message) / 1000, 0))
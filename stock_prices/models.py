@@ -1,11 +1,16 @@
+import enum
 import json
+import re
 from datetime import datetime
 from decimal import Decimal
 from typing import Any, Optional
 
-from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field, validator
 
+from stock_prices.streams import STREAM_ID_PATTERN
+
+TICKER_NAME_PATTERN = r'^[\w.-]{1,64}$'
+
 
 class TickerPrice(BaseModel):
     name: str
@@ -13,7 +18,31 @@ class TickerPrice(BaseModel):
     created_at: datetime
 
     def encoded(self) -> dict[str, Any]:
-        return jsonable_encoder(self.dict())
+        return {'name': self.name, 'price': float(self.price), 'created_at': self.created_at.isoformat()}
+
+
+class StoredTickerPrice(TickerPrice):
+    id: int
+
+
+class CandleResolution(str, enum.Enum):
+    MINUTE = '1m'
+    FIVE_MINUTES = '5m'
+    HOUR = '1h'
+
+    @property
+    def seconds(self) -> int:
+        return {'1m': 60, '5m': 5 * 60, '1h': 60 * 60}[self.value]
+
+
+class TickerCandle(BaseModel):
+    name: str
+    resolution: CandleResolution
+    started_at: datetime
+    open: Decimal
+    high: Decimal
+    low: Decimal
+    close: Decimal
 
 
 class RedisPriceMessage(BaseModel):
@@ -25,3 +54,28 @@ class RedisPriceMessage(BaseModel):
         if values['type'] != 'message':
             return None
         return json.loads(value)
+
+
+class TrackingAction(str, enum.Enum):
+    SUBSCRIBE = 'subscribe'
+    UNSUBSCRIBE = 'unsubscribe'
+
+
+class TrackingCommand(BaseModel):
+    action: TrackingAction
+    tickers: list[str]
+    # the last stream id a client has got per ticker, to replay what it has missed
+    resume: dict[str, str] = {}
+
+    @validator('tickers', each_item=True)
+    def check_ticker_name(cls, value: str) -> str:  # noqa: N805
+        if not re.match(TICKER_NAME_PATTERN, value):
+            raise ValueError(f'Incorrect ticker name {value!r}')
+        return value
+
+    @validator('resume')
+    def check_resume(cls, value: dict[str, str]) -> dict[str, str]:  # noqa: N805
+        for ticker_name, stream_id in value.items():
+            if not re.match(TICKER_NAME_PATTERN, ticker_name) or not re.match(STREAM_ID_PATTERN, stream_id):
+                raise ValueError(f'Incorrect resume token {stream_id!r} for {ticker_name!r}')
+        return value
@@ -0,0 +1,96 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from stock_prices import db
+
+logger = logging.getLogger(__name__)
+
+_PARTITIONS_QUERY = sa.text(
+    '''
+    SELECT
+        name,
+        substring(bound FROM $$FROM \\('(.*)'\\) TO$$)::timestamptz AS starts_at,
+        substring(bound FROM $$TO \\('(.*)'\\)$$)::timestamptz AS ends_at
+    FROM (
+        SELECT partition.relname AS name, pg_get_expr(partition.relpartbound, partition.oid) AS bound
+        FROM pg_inherits
+        JOIN pg_class AS partition ON partition.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'ticker_price'::regclass
+    ) AS partitions
+    '''
+)
+
+
+def partition_name(day: date) -> str:
+    return f'ticker_price_p{day:%Y%m%d}'
+
+
+def create_partitions(session: so.Session, first_day: date, days: int) -> list[str]:
+    existing = session.execute(_PARTITIONS_QUERY).all()
+    created = []
+    for day in (first_day + timedelta(days=offset) for offset in range(days)):
+        starts_at = _day_start(day)
+        # bounds are NULL for MINVALUE/MAXVALUE and for the default partition
+        if any(
+            row.ends_at and (row.starts_at is None or row.starts_at <= starts_at) and starts_at < row.ends_at
+            for row in existing
+        ):
+            continue
+        name = partition_name(day)
+        _create_partition(session, name, starts_at=starts_at, ends_at=_day_start(day + timedelta(days=1)))
+        created.append(name)
+    return created
+
+
+def retire_partitions(session: so.Session, before: date, archive_schema: Optional[str] = None) -> list[str]:
+    expired = [
+        row.name for row in session.execute(_PARTITIONS_QUERY) if row.ends_at and row.ends_at <= _day_start(before)
+    ]
+    if expired and archive_schema:
+        session.execute(sa.text(f'CREATE SCHEMA IF NOT EXISTS {archive_schema}'))
+
+    for name in expired:
+        if archive_schema:
+            logger.info('Archive partition %s to schema %s', name, archive_schema)
+            session.execute(sa.text(f'ALTER TABLE ticker_price DETACH PARTITION {name}'))
+            session.execute(sa.text(f'ALTER TABLE {name} SET SCHEMA {archive_schema}'))
+        else:
+            logger.info('Drop partition %s', name)
+            session.execute(sa.text(f'DROP TABLE {name}'))
+    return expired
+
+
+def _create_partition(session: so.Session, name: str, starts_at: datetime, ends_at: datetime) -> None:
+    logger.info('Create partition %s for prices from %s to %s', name, starts_at, ends_at)
+    bounds = {'starts_at': starts_at, 'ends_at': ends_at}
+    # rows written before the partition existed landed in the default one and would block the attach
+    session.execute(sa.text(f'CREATE TABLE {name} (LIKE ticker_price INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    session.execute(
+        sa.text(
+            f'''
+            WITH moved AS (
+                DELETE FROM {db.TICKER_PRICE_DEFAULT_PARTITION}
+                WHERE created_at >= :starts_at AND created_at < :ends_at
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            '''
+        ),
+        bounds,
+    )
+    session.execute(
+        sa.text(
+            f'''
+            ALTER TABLE ticker_price ATTACH PARTITION {name}
+            FOR VALUES FROM ('{starts_at.isoformat()}') TO ('{ends_at.isoformat()}')
+            '''
+        )
+    )
+
+
+def _day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
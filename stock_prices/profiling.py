@@ -0,0 +1,93 @@
+import contextlib
+import cProfile
+import logging
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from random import random
+from typing import Any, ContextManager, Iterator, Optional
+
+import sqlalchemy as sa
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp
+
+logger = logging.getLogger(__name__)
+
+_slow_query_seconds: Optional[float] = None
+
+
+class Profiler:
+    def __init__(self, directory: Path, max_files: int) -> None:
+        self._directory = directory
+        self._max_files = max_files
+        self._calls: Counter[str] = Counter()
+        self._active = False
+
+    @contextlib.contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        # only one cProfile profiler can be active in a thread, so overlapping samples are skipped
+        if self._active:
+            yield
+            return
+
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._active = False
+            self._dump(profile, name)
+
+    def sampled(self, rate: float, name: str) -> ContextManager[None]:
+        return self.profile(name) if random() < rate else contextlib.nullcontext()
+
+    def every(self, calls: int, name: str) -> ContextManager[None]:
+        self._calls[name] += 1
+        return self.profile(name) if calls > 0 and self._calls[name] % calls == 0 else contextlib.nullcontext()
+
+    def _dump(self, profile: cProfile.Profile, name: str) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        file_name = re.sub(r'[^\w.-]', '_', name)
+        path = self._directory / f'{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{file_name}.pstats'
+        profile.dump_stats(path)
+        logger.info('Profile of %s is written to %s', name, path)
+
+        for stale_path in sorted(self._directory.glob('*.pstats'))[: -self._max_files]:
+            stale_path.unlink()
+
+
+class ProfilingMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app: ASGIApp, profiler: Profiler, sample_rate: float) -> None:
+        super().__init__(app)
+        self._profiler = profiler
+        self._sample_rate = sample_rate
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        # the profile also catches other requests served by the event loop meanwhile
+        with self._profiler.sampled(self._sample_rate, f'request{request.url.path}'):
+            return await call_next(request)
+
+
+def log_slow_queries(seconds: Optional[float]) -> None:
+    global _slow_query_seconds
+
+    _slow_query_seconds = seconds
+    if seconds is not None and not sa.event.contains(sa.engine.Engine, 'before_cursor_execute', _start_query):
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', _start_query)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute', _finish_query)
+
+
+def _start_query(connection: sa.engine.Connection, *_: Any) -> None:
+    connection.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _finish_query(connection: sa.engine.Connection, cursor: Any, statement: str, *_: Any) -> None:
+    duration = time.perf_counter() - connection.info['query_started_at'].pop()
+    if _slow_query_seconds is not None and duration >= _slow_query_seconds:
+        logger.warning('Slow query took %.3fs: %s', duration, statement)
@@ -0,0 +1,113 @@
+import json
+import logging
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional, Sequence
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from stock_prices import db
+
+if TYPE_CHECKING:
+    from aioredis import Redis
+    from aioredis.client import Pipeline
+
+    from stock_prices.models import StoredTickerPrice
+
+logger = logging.getLogger(__name__)
+
+_WARM_BATCH_SIZE = 100
+
+
+class RecentPrice(NamedTuple):
+    id: int
+    created_at: datetime
+    price: Optional[Decimal]
+
+
+class RecentPrices:
+    def __init__(self, prefix: str, max_len: int) -> None:
+        self._prefix = prefix
+        self._max_len = max_len
+
+    def key(self, ticker_name: str) -> str:
+        return f'{self._prefix}{ticker_name}'
+
+    def add(self, pipe: 'Pipeline', prices: Sequence['StoredTickerPrice']) -> None:
+        for price in prices:
+            key = self.key(price.name)
+            pipe.zadd(key, {_dumps(price.id, price.created_at, price.price): price.id})
+            pipe.zremrangebyrank(key, 0, -self._max_len - 1)
+
+    async def read(self, redis: 'Redis', ticker_name: str) -> list[RecentPrice]:
+        return [_loads(member) for member in await redis.zrange(self.key(ticker_name), 0, -1)]
+
+    async def warm(self, redis: 'Redis', session: so.Session, ticker_ids: Sequence[int]) -> None:
+        for start in range(0, len(ticker_ids), _WARM_BATCH_SIZE):
+            rows = session.execute(self._build_latest_prices(ticker_ids[start : start + _WARM_BATCH_SIZE])).all()
+            members: dict[str, dict[str, int]] = {}
+            for row in rows:
+                members.setdefault(row.name, {})[_dumps(row.id, row.created_at, row.price)] = row.id
+            # buffers are replaced at once, so the server never reads a half warmed one
+            async with redis.pipeline(transaction=True) as pipe:
+                for ticker_name, ticker_members in members.items():
+                    pipe.delete(self.key(ticker_name))
+                    pipe.zadd(self.key(ticker_name), ticker_members)
+                await pipe.execute()
+        logger.info('Recent prices of %d tickers are warmed up', len(ticker_ids))
+
+    def _build_latest_prices(self, ticker_ids: Sequence[int]) -> sa.sql.Select:
+        latest = (
+            sa.select(db.TickerPrice.id, db.TickerPrice.created_at, db.TickerPrice.price)
+            .where(db.TickerPrice.ticker_id == db.Ticker.id)
+            .order_by(db.TickerPrice.id.desc())
+            .limit(self._max_len)
+            .lateral('latest')
+        )
+        return sa.select(db.Ticker.name, latest).join(latest, sa.true()).where(db.Ticker.id.in_(ticker_ids))
+
+
+def select_recent(
+    prices: list[RecentPrice],
+    from_: Optional[datetime] = None,
+    to: Optional[datetime] = None,
+    since: Optional[datetime] = None,
+    after_id: Optional[int] = None,
+) -> Optional[list[RecentPrice]]:
+    # a buffer only gets newer prices and loses the oldest ones, so it holds every price of a ticker since its
+    # oldest entry: any range starting after that entry is served from it, other ranges have to go to the database
+    if not prices:
+        return None
+
+    from_, to, since = _as_aware(from_), _as_aware(to), _as_aware(since)
+    oldest = prices[0]
+    covered = (
+        (from_ is not None and oldest.created_at < from_)
+        or (since is not None and oldest.created_at <= since)
+        or (after_id is not None and oldest.id <= after_id)
+    )
+    if not covered:
+        return None
+    return [
+        price
+        for price in prices
+        if (from_ is None or price.created_at >= from_)
+        and (to is None or price.created_at < to)
+        and (since is None or price.created_at > since)
+        and (after_id is None or price.id > after_id)
+    ]
+
+
+def _as_aware(value: Optional[datetime]) -> Optional[datetime]:
+    # naive datetimes are compared by postgres in the UTC session time zone
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+
+def _dumps(price_id: int, created_at: datetime, price: Any) -> str:
+    return json.dumps([price_id, created_at.isoformat(), None if price is None else str(price)], separators=(',', ':'))
+
+
+def _loads(member: str) -> RecentPrice:
+    price_id, created_at, price = json.loads(member)
+    return RecentPrice(price_id, datetime.fromisoformat(created_at), None if price is None else Decimal(price))
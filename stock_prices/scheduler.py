@@ -0,0 +1,70 @@
+import heapq
+import math
+import re
+from typing import NamedTuple, Optional
+
+
+class Tier(NamedTuple):
+    pattern: str
+    interval: float
+
+
+class DueTickers(NamedTuple):
+    ticker_ids: list[int]
+    # updates skipped because the batch was picked up later than the next period of a ticker
+    missed: int
+
+
+class TickerScheduler:
+    def __init__(self, default_interval: float, tiers: Optional[list[Tier]] = None) -> None:
+        # a zero interval means updating back-to-back, negative ones are treated the same
+        self._default_interval = max(default_interval, 0.0)
+        self._tiers = [(re.compile(tier.pattern), max(tier.interval, 0.0)) for tier in tiers or []]
+        self._intervals: dict[int, float] = {}
+        self._queue: list[tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    @property
+    def shortest_interval(self) -> float:
+        return min(self._intervals.values(), default=self._default_interval)
+
+    def interval_of(self, ticker_name: str) -> float:
+        for pattern, interval in self._tiers:
+            if pattern.fullmatch(ticker_name):
+                return interval
+        return self._default_interval
+
+    def sync(self, tickers: list[tuple[int, str]], now: float) -> None:
+        intervals = {ticker_id: self.interval_of(name) for ticker_id, name in tickers}
+        for ticker_id in intervals.keys() - self._intervals.keys():
+            heapq.heappush(self._queue, (now, ticker_id))
+        # removed tickers are dropped lazily when they become due
+        self._intervals = intervals
+
+    def next_due_at(self) -> Optional[float]:
+        return self._queue[0][0] if self._queue else None
+
+    def pop_due(self, now: float) -> DueTickers:
+        ticker_ids, missed = [], 0
+        rescheduled = []
+        while self._queue and self._queue[0][0] <= now:
+            due_at, ticker_id = heapq.heappop(self._queue)
+            interval = self._intervals.get(ticker_id)
+            if interval is None:
+                continue
+
+            ticker_ids.append(ticker_id)
+            if not interval:
+                # pushed back after the loop, so the ticker is due again on the next call and not in this one
+                rescheduled.append((now, ticker_id))
+                continue
+
+            # the next update is scheduled from the due time and not from now, so the delays do not add up
+            periods = max(math.floor((now - due_at) / interval), 0)
+            missed += periods
+            rescheduled.append((due_at + (periods + 1) * interval, ticker_id))
+        for entry in rescheduled:
+            heapq.heappush(self._queue, entry)
+        return DueTickers(ticker_ids, missed)
@@ -1,9 +1,20 @@
 import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
+import aioredis
 import sqlalchemy as sa
 from pydantic import BaseSettings, validator
+from sqlalchemy.ext.asyncio import create_async_engine
 
-from stock_prices.db import Session
+from stock_prices.db import AsyncSession, Session
+from stock_prices.hub import OverflowPolicy
+from stock_prices.profiling import Profiler, log_slow_queries
+from stock_prices.recent_prices import RecentPrices
+from stock_prices.streams import PriceStreams
+
+if TYPE_CHECKING:
+    from aioredis import Redis
 
 
 class LoggingSetting(BaseSettings):
@@ -33,17 +44,113 @@ class CORSSettings(BaseSettings):
 
 class DBSettings(BaseSettings):
     url: str = 'postgresql://postgres@localhost:5432/postgres'
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    command_timeout: float = 60.0
 
     class Config:
         env_prefix = 'DB_'
 
+    @property
+    def async_url(self) -> sa.engine.URL:
+        return sa.engine.make_url(self.url).set(drivername='postgresql+asyncpg')
+
     def setup(self, echo: bool = False) -> None:
-        engine = sa.create_engine(url=self.url, echo=echo)
+        pool_options = {
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_timeout': self.pool_timeout,
+            'pool_recycle': self.pool_recycle,
+            'pool_pre_ping': self.pool_pre_ping,
+        }
+        engine = sa.create_engine(url=self.url, echo=echo, **pool_options)
         Session.configure(bind=engine)
+        async_engine = create_async_engine(
+            self.async_url, echo=echo, connect_args={'command_timeout': self.command_timeout}, **pool_options
+        )
+        AsyncSession.configure(bind=async_engine)
+
+
+class PartitionSettings(BaseSettings):
+    retention_days: int = 30
+    premake_days: int = 3
+    archive_schema: Optional[str] = None
+
+    class Config:
+        env_prefix = 'PARTITION_'
 
 
 class RedisSettings(BaseSettings):
     url: str = 'redis://localhost:6379'
+    max_connections: int = 50
+    pool_timeout: float = 5.0
+    socket_timeout: Optional[float] = None
+    socket_connect_timeout: float = 5.0
+    health_check_interval: int = 30
+    board_channel: str = 'stock-prices:board'
+    tickers_channel: str = 'stock-prices:tickers'
+    streams_enabled: bool = False
+    stream_prefix: str = 'stock-prices:stream:'
+    stream_max_len: int = 10000
+    recent_prices_enabled: bool = False
+    recent_prices_prefix: str = 'stock-prices:recent:'
+    recent_prices_max_len: int = 3600
 
     class Config:
         env_prefix = 'REDIS_'
+
+    def create_redis(self) -> 'Redis':
+        # waits up to pool_timeout for a free connection instead of opening more than max_connections
+        pool = aioredis.BlockingConnectionPool.from_url(
+            self.url,
+            decode_responses=True,
+            max_connections=self.max_connections,
+            timeout=self.pool_timeout,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.socket_connect_timeout,
+            health_check_interval=self.health_check_interval,
+        )
+        return aioredis.Redis(connection_pool=pool)
+
+    def create_price_streams(self) -> Optional[PriceStreams]:
+        if not self.streams_enabled:
+            return None
+        return PriceStreams(prefix=self.stream_prefix, max_len=self.stream_max_len)
+
+    def create_recent_prices(self) -> Optional[RecentPrices]:
+        if not self.recent_prices_enabled:
+            return None
+        return RecentPrices(prefix=self.recent_prices_prefix, max_len=self.recent_prices_max_len)
+
+
+class WebSocketSettings(BaseSettings):
+    send_queue_size: int = 100
+    overflow_policy: OverflowPolicy = OverflowPolicy.CONFLATE
+    batch_window: float = 0.05
+    max_tracked_tickers: int = 100
+
+    class Config:
+        env_prefix = 'WEBSOCKET_'
+
+
+class ProfilingSettings(BaseSettings):
+    enabled: bool = False
+    directory: Path = Path('profiles')
+    max_files: int = 100
+    request_sample_rate: float = 0.01
+    tick_every: int = 100
+    slow_query_seconds: Optional[float] = None
+
+    class Config:
+        env_prefix = 'PROFILING_'
+
+    def setup(self) -> None:
+        log_slow_queries(self.slow_query_seconds)
+
+    def create_profiler(self) -> Optional[Profiler]:
+        if not self.enabled:
+            return None
+        return Profiler(self.directory, max_files=self.max_files)
@@ -0,0 +1,48 @@
+import json
+import re
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from aioredis import Redis
+
+STREAM_ID_PATTERN = r'^\d+-\d+$'
+
+StreamId = tuple[int, int]
+
+
+def parse_stream_id(stream_id: str) -> StreamId:
+    milliseconds, sequence = stream_id.split('-')
+    return int(milliseconds), int(sequence)
+
+
+def stream_id_of(message: str) -> Optional[StreamId]:
+    stream_id = json.loads(message).get('id')
+    return (
+        parse_stream_id(stream_id) if isinstance(stream_id, str) and re.match(STREAM_ID_PATTERN, stream_id) else None
+    )
+
+
+def with_stream_id(stream_id: str, message: str) -> str:
+    # messages are JSON objects encoded once by the producer, so the id is spliced in instead of re-encoding them
+    return f'{{"id":"{stream_id}",{message[1:]}'
+
+
+class PriceStreams:
+    def __init__(self, prefix: str, max_len: int) -> None:
+        self._prefix = prefix
+        self._max_len = max_len
+
+    def key(self, ticker_name: str) -> str:
+        return f'{self._prefix}{ticker_name}'
+
+    async def add(self, redis: 'Redis', messages: list[tuple[str, str]]) -> list[str]:
+        async with redis.pipeline(transaction=False) as pipe:
+            for ticker_name, message in messages:
+                pipe.xadd(self.key(ticker_name), {'data': message}, maxlen=self._max_len, approximate=True)
+            stream_ids = await pipe.execute()
+        return [with_stream_id(stream_id, message) for stream_id, (_, message) in zip(stream_ids, messages)]
+
+    async def read_after(self, redis: 'Redis', ticker_name: str, stream_id: str) -> list[str]:
+        milliseconds, sequence = parse_stream_id(stream_id)
+        entries = await redis.xrange(self.key(ticker_name), min=f'{milliseconds}-{sequence + 1}', count=self._max_len)
+        return [with_stream_id(entry_id, fields['data']) for entry_id, fields in entries]
@@ -0,0 +1,63 @@
+import bisect
+import json
+import logging
+from itertools import islice, takewhile
+from typing import Iterable, Iterator, Optional
+
+import sqlalchemy as sa
+
+from stock_prices import db
+
+logger = logging.getLogger(__name__)
+
+
+class TickerIndex:
+    def __init__(self) -> None:
+        # (lowercased name, name) pairs give case insensitive search with a stable order for the cursor
+        self._entries: list[tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self, names: Iterable[str]) -> None:
+        self._entries = sorted({(name.lower(), name) for name in names})
+        logger.info('Ticker index is loaded with %d tickers', len(self._entries))
+
+    def add(self, names: Iterable[str]) -> None:
+        self._entries = sorted({*self._entries, *((name.lower(), name) for name in names)})
+
+    def update_from_message(self, data: str) -> None:
+        try:
+            names = json.loads(data)
+        except ValueError:
+            logger.exception('Cannot parse new tickers message')
+            return
+
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            logger.error('Got new tickers message of unexpected shape, skip it')
+            return
+        self.add(names)
+
+    def search(
+        self, query: str = '', limit: int = 50, cursor: Optional[str] = None, prefix: bool = False
+    ) -> tuple[list[str], Optional[str]]:
+        query = query.lower()
+        start = 0 if cursor is None else bisect.bisect_right(self._entries, (cursor.lower(), cursor))
+        if prefix:
+            start = max(start, bisect.bisect_left(self._entries, (query, '')))
+        entries = (self._entries[position] for position in range(start, len(self._entries)))
+        if prefix:
+            # entries sharing a prefix are adjacent in the sorted index
+            matches: Iterator[tuple[str, str]] = takewhile(lambda entry: entry[0].startswith(query), entries)
+        else:
+            matches = (entry for entry in entries if query in entry[0])
+
+        names = [name for _, name in islice(matches, limit + 1)]
+        if len(names) > limit:
+            return names[:limit], names[limit - 1]
+        return names, None
+
+
+async def load_ticker_names() -> list[str]:
+    async with db.create_async_session() as session:
+        return (await session.execute(sa.select(db.Ticker.name))).scalars().all()
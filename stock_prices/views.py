@@ -1,105 +1,671 @@
 import asyncio
 import enum
+import hashlib
+import json
 import logging
+import re
+from datetime import datetime
 from functools import lru_cache
-from typing import TYPE_CHECKING, Any, cast
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, AsyncIterator, Optional, Sequence, Union
 
-import aioredis
-import sqlalchemy.orm as so
+import sqlalchemy as sa
 from aioredis import Redis, RedisError
-from fastapi import Depends, Request
+from fastapi import Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
-from starlette.websockets import WebSocket
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.websockets import WebSocket, WebSocketDisconnect
 from websockets.exceptions import WebSocketException
 
-from stock_prices import db
-from stock_prices.models import RedisPriceMessage, TickerPrice
-from stock_prices.settings import RedisSettings
+from stock_prices import db, metrics
+from stock_prices.downsampling import largest_triangle_three_buckets
+from stock_prices.formats import (
+    WireFormat,
+    encode_messages,
+    encode_series,
+    epoch_ms,
+    negotiate_media_type,
+    negotiate_subprotocol,
+)
+from stock_prices.hub import PriceHub, SubscriptionError
+from stock_prices.latest_prices import LatestPrices
+from stock_prices.models import (
+    TICKER_NAME_PATTERN,
+    CandleResolution,
+    TickerCandle,
+    TickerPrice,
+    TrackingAction,
+    TrackingCommand,
+)
+from stock_prices.recent_prices import RecentPrices, select_recent
+from stock_prices.settings import RedisSettings, WebSocketSettings
+from stock_prices.streams import PriceStreams, StreamId, parse_stream_id, stream_id_of
+from stock_prices.ticker_index import TickerIndex
 
 if TYPE_CHECKING:
-    from aioredis.client import PubSub
-    from starlette.responses import Response
+    from sqlalchemy.sql import Select
+
+    from stock_prices.hub import SendQueue
 
 logger = logging.getLogger(__name__)
 
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+_STREAM_CHUNK_SIZE = 1000
+_REPLAY_FRAME_SIZE = 1000
+
 
 class WebSocketCloseCode(int, enum.Enum):
+    UNSUPPORTED_DATA = 1003
+    POLICY_VIOLATION = 1008
     INTERNAL_ERROR = 1011
     TRY_AGAIN_LATER = 1013
 
 
+_SUBSCRIPTION_ERROR_CLOSE_CODES = {
+    SubscriptionError.REDIS_UNAVAILABLE: WebSocketCloseCode.TRY_AGAIN_LATER,
+    SubscriptionError.SLOW_CONSUMER: WebSocketCloseCode.POLICY_VIOLATION,
+}
+
+
 @lru_cache(maxsize=None)
 def get_template() -> Jinja2Templates:
     return Jinja2Templates('static/templates')
 
 
+@lru_cache(maxsize=None)
+def get_websocket_settings() -> WebSocketSettings:
+    return WebSocketSettings()
+
+
 async def get_redis() -> 'Redis':
-    settings = RedisSettings()
-    return aioredis.from_url(settings.url, decode_responses=True)
+    return RedisSettings().create_redis()
+
+
+def get_app_redis(request: Request) -> Redis:
+    return request.app.state.redis
 
 
-def home(request: Request, templates: Jinja2Templates = Depends(get_template)) -> 'Response':
-    with db.create_session() as session:
-        tickers = session.query(db.Ticker).options(so.load_only(db.Ticker.name)).all()
-        ticker_names = [t.name for t in tickers]
+async def get_db_session() -> AsyncIterator[AsyncSession]:
+    async with db.create_async_session() as session:
+        yield session
 
+
+async def home(request: Request, templates: Jinja2Templates = Depends(get_template)) -> 'Response':
+    ticker_index: TickerIndex = request.app.state.ticker_index
+    # the rest of tickers are searched by the page through /tickers
+    ticker_names, _ = ticker_index.search(limit=1)
     return templates.TemplateResponse('home.html', {'request': request, 'tickers': ticker_names})
 
 
-def get_ticker_price(ticker_name: str) -> list[TickerPrice]:
-    with db.create_session() as session:
-        last_prices: list[db.TickerPrice] = (
-            session.query(db.TickerPrice)
-            .join(db.Ticker, db.Ticker.id == db.TickerPrice.ticker_id)
-            .filter(db.Ticker.name == ticker_name)
-            .order_by(db.TickerPrice.id.asc())
-            .all()
+async def get_tickers(
+    request: Request,
+    response: Response,
+    q: str = '',
+    limit: int = Query(50, gt=0, le=1000),
+    cursor: Optional[str] = None,
+    prefix: bool = False,
+) -> list[str]:
+    ticker_index: TickerIndex = request.app.state.ticker_index
+    ticker_names, next_cursor = ticker_index.search(q, limit=limit, cursor=cursor, prefix=prefix)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return ticker_names
+
+
+async def get_ticker_price(
+    request: Request,
+    response: Response,
+    ticker_name: str,
+    from_: Optional[datetime] = Query(None, alias='from'),
+    to: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, gt=0),
+    cursor: Optional[int] = None,
+    after_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    resolution: Optional[int] = Query(None, ge=3),
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    redis: Redis = Depends(get_app_redis),
+    session: AsyncSession = Depends(get_db_session),
+) -> Union[list[TickerPrice], Response]:
+    # the ticker id is looked up first, so the planner knows it and scans (ticker_id, id) in the asked order
+    ticker_id = sa.select(db.Ticker.id).where(db.Ticker.name == ticker_name).scalar_subquery()
+    query = _filter_prices(
+        sa.select(db.TickerPrice.id, db.TickerPrice.created_at, db.TickerPrice.price)
+        .where(db.TickerPrice.ticker_id == ticker_id)
+        .order_by(db.TickerPrice.id.asc()),
+        from_=from_,
+        to=to,
+        cursor=cursor,
+        after_id=after_id,
+        since=since,
+    )
+
+    wire_format = negotiate_media_type(accept)
+    response.headers['Vary'] = 'Accept'
+    recent_prices: Optional[RecentPrices] = request.app.state.recent_prices
+    if recent_prices is not None and resolution is None and not stream:
+        ids = [i for i in (cursor, after_id) if i is not None]
+        recent_response = await _get_recent_prices(
+            request,
+            response,
+            redis,
+            recent_prices,
+            ticker_name,
+            from_=from_,
+            to=to,
+            limit=limit,
+            after_id=max(ids, default=None),
+            since=since,
+            wire_format=wire_format,
+            if_none_match=if_none_match,
         )
-        return [TickerPrice(name=ticker_name, price=p.price, created_at=p.created_at) for p in last_prices]
+        if recent_response is not None:
+            return recent_response
 
+    latest_price_id = (
+        await session.execute(
+            sa.select(db.TickerLastPrice.price_id)
+            .join(db.Ticker, db.Ticker.id == db.TickerLastPrice.ticker_id)
+            .where(db.Ticker.name == ticker_name)
+        )
+    ).scalar()
+    not_modified = _check_etag(response, latest_price_id, request, wire_format, if_none_match)
+    if not_modified is not None:
+        return not_modified
 
-async def ticker_price(websocket: 'WebSocket', redis: 'Redis' = Depends(get_redis)) -> None:
-    await websocket.accept()
+    if limit is not None:
+        next_page = (
+            await session.execute(query.with_only_columns(db.TickerPrice.id).offset(limit - 1).limit(2))
+        ).all()
+        if len(next_page) > 1:
+            response.headers['X-Next-Cursor'] = str(next_page[0].id)
+        query = query.limit(limit)
 
-    ticker_name = await websocket.receive_text()
-    logger.info('Start tracking price updates for %s', ticker_name)
+    if stream and resolution is None and wire_format is WireFormat.JSON:
+        # rows are streamed by a session of their own, so the connection of this one is not held meanwhile
+        await session.close()
+        ndjson = accept is not None and NDJSON_MEDIA_TYPE in accept
+        return StreamingResponse(
+            _stream_prices(query, ticker_name, ndjson=ndjson),
+            media_type=NDJSON_MEDIA_TYPE if ndjson else 'application/json',
+            headers=dict(response.headers),
+        )
+
+    last_prices = await _read_prices(session, query, resolution)
+    return _encode_prices(response, ticker_name, last_prices, wire_format)
+
+
+async def _read_prices(session: AsyncSession, query: 'Select', resolution: Optional[int]) -> Sequence[Any]:
+    if resolution is None:
+        with metrics.HISTORY_QUERY_DURATION.labels('raw').time():
+            return (await session.execute(query)).all()
+
+    with metrics.HISTORY_QUERY_DURATION.labels('downsampled').time():
+        buckets = await _min_max_per_bucket(session, query, buckets=resolution)
+    return largest_triangle_three_buckets(
+        buckets,
+        threshold=resolution,
+        x=lambda p: p.created_at.timestamp(),
+        y=lambda p: float(p.price),
+    )
+
+
+async def _get_recent_prices(
+    request: Request,
+    response: Response,
+    redis: Redis,
+    recent_prices: RecentPrices,
+    ticker_name: str,
+    from_: Optional[datetime],
+    to: Optional[datetime],
+    limit: Optional[int],
+    after_id: Optional[int],
+    since: Optional[datetime],
+    wire_format: WireFormat,
+    if_none_match: Optional[str],
+) -> Union[list[TickerPrice], Response, None]:
+    with metrics.HISTORY_QUERY_DURATION.labels('recent').time():
+        buffered = await recent_prices.read(redis, ticker_name)
+        recent = select_recent(buffered, from_=from_, to=to, since=since, after_id=after_id)
+    if recent is None:
+        return None
+
+    not_modified = _check_etag(response, buffered[-1].id, request, wire_format, if_none_match)
+    if not_modified is not None:
+        return not_modified
+    if limit is not None and len(recent) > limit:
+        response.headers['X-Next-Cursor'] = str(recent[limit - 1].id)
+        recent = recent[:limit]
+    return _encode_prices(response, ticker_name, recent, wire_format)
 
-    async with redis.pubsub() as reader:
-        await reader.subscribe(ticker_name)
-        await listen_to_updates(reader, websocket, ticker_name)
 
+def _filter_prices(
+    query: 'Select',
+    from_: Optional[datetime] = None,
+    to: Optional[datetime] = None,
+    cursor: Optional[int] = None,
+    after_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+) -> 'Select':
+    if from_ is not None:
+        query = query.where(db.TickerPrice.created_at >= from_)
+    if to is not None:
+        query = query.where(db.TickerPrice.created_at < to)
+    if cursor is not None:
+        query = query.where(db.TickerPrice.id > cursor)
+    if after_id is not None:
+        query = query.where(db.TickerPrice.id > after_id)
+    if since is not None:
+        query = query.where(db.TickerPrice.created_at > since)
+    return query
+
+
+def _check_etag(
+    response: Response,
+    latest_price_id: Optional[int],
+    request: Request,
+    wire_format: WireFormat,
+    if_none_match: Optional[str],
+) -> Optional[Response]:
+    # prices are only appended, so the latest price id changes whenever any answer may change
+    etag = _price_etag(latest_price_id, request.url.query, wire_format)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=dict(response.headers))
+    return None
+
+
+def _encode_prices(
+    response: Response, ticker_name: str, last_prices: Sequence[Any], wire_format: WireFormat
+) -> Union[list[TickerPrice], Response]:
+    if last_prices:
+        response.headers['X-Last-Id'] = str(last_prices[-1].id)
+    if wire_format is not WireFormat.JSON:
+        points = [(epoch_ms(p.created_at), None if p.price is None else float(p.price)) for p in last_prices]
+        return Response(
+            content=encode_series(wire_format, ticker_name, points),
+            media_type=wire_format.media_type,
+            headers=dict(response.headers),
+        )
+    return [TickerPrice(name=ticker_name, price=p.price, created_at=p.created_at) for p in last_prices]
+
+
+def _price_etag(latest_price_id: Optional[int], query: str, wire_format: WireFormat) -> str:
+    digest = hashlib.sha1(f'{query}|{wire_format.value}'.encode()).hexdigest()[:16]
+    return f'"{latest_price_id or 0}-{digest}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    return any(tag.strip().removeprefix('W/') in ('*', etag) for tag in if_none_match.split(','))
+
+
+async def _stream_prices(query: 'Select', ticker_name: str, ndjson: bool) -> AsyncIterator[bytes]:
+    if not ndjson:
+        yield b'['
+    is_first_chunk = True
+    async with db.create_async_session() as session:
+        result = await session.stream(query.execution_options(yield_per=_STREAM_CHUNK_SIZE))
+        async for rows in result.partitions():
+            if ndjson:
+                yield b''.join(_dumps_price(ticker_name, row) + b'\n' for row in rows)
+            else:
+                chunk = b','.join(_dumps_price(ticker_name, row) for row in rows)
+                yield chunk if is_first_chunk else b',' + chunk
+            is_first_chunk = False
+    if not ndjson:
+        yield b']'
+
+
+def _dumps_price(ticker_name: str, row: Any) -> bytes:
+    price = None if row.price is None else float(row.price)
+    return json.dumps({'name': ticker_name, 'price': price, 'created_at': row.created_at.isoformat()}).encode()
+
+
+async def _min_max_per_bucket(session: AsyncSession, query: 'Select', buckets: int) -> list[sa.engine.Row]:
+    prices = query.subquery()
+    bucketed = (
+        sa.select(
+            prices,
+            sa.func.ntile(buckets).over(order_by=prices.c.id).label('bucket'),
+            sa.func.row_number().over(order_by=prices.c.id).label('position'),
+            sa.func.count().over().label('total'),
+        )
+        .where(prices.c.price.isnot(None))
+        .subquery()
+    )
+    ranked = sa.select(
+        bucketed,
+        sa.func.row_number()
+        .over(partition_by=bucketed.c.bucket, order_by=(bucketed.c.price.asc(), bucketed.c.id))
+        .label('lowest'),
+        sa.func.row_number()
+        .over(partition_by=bucketed.c.bucket, order_by=(bucketed.c.price.desc(), bucketed.c.id))
+        .label('highest'),
+    ).subquery()
+    result = await session.execute(
+        sa.select(ranked.c.id, ranked.c.created_at, ranked.c.price)
+        .where(
+            sa.or_(
+                ranked.c.lowest == 1,
+                ranked.c.highest == 1,
+                ranked.c.position == 1,
+                ranked.c.position == ranked.c.total,
+            )
+        )
+        .order_by(ranked.c.id)
+    )
+    return result.all()
+
+
+async def get_ticker_candles(
+    ticker_name: str,
+    resolution: CandleResolution = CandleResolution.MINUTE,
+    from_: Optional[datetime] = Query(None, alias='from'),
+    to: Optional[datetime] = None,
+    limit: int = Query(1000, gt=0, le=10000),
+    session: AsyncSession = Depends(get_db_session),
+) -> list[TickerCandle]:
+    query = (
+        sa.select(db.TickerCandle)
+        .join(db.Ticker, db.Ticker.id == db.TickerCandle.ticker_id)
+        .where(db.Ticker.name == ticker_name, db.TickerCandle.resolution == resolution.seconds)
+        .order_by(db.TickerCandle.started_at.asc())
+    )
+    if from_ is not None:
+        query = query.where(db.TickerCandle.started_at >= from_)
+    if to is not None:
+        query = query.where(db.TickerCandle.started_at < to)
+
+    candles: list[db.TickerCandle] = (await session.execute(query.limit(limit))).scalars().all()
+
+    return [
+        TickerCandle(
+            name=ticker_name,
+            resolution=resolution,
+            started_at=c.started_at,
+            open=c.open,
+            high=c.high,
+            low=c.low,
+            close=c.close,
+        )
+        for c in candles
+    ]
 
-async def _get_message(reader: 'PubSub') -> dict[str, Any]:
-    return await reader.get_message()
 
+async def get_latest_prices(request: Request, tickers: Optional[list[str]] = Query(None)) -> Response:
+    latest_prices: LatestPrices = request.app.state.latest_prices
+    return Response(content=latest_prices.encoded(tickers), media_type='application/json')
 
-async def listen_to_updates(reader: 'PubSub', websocket: 'WebSocket', ticker_name: str) -> None:
+
+async def get_metrics() -> Response:
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def get_price_hub(websocket: 'WebSocket') -> PriceHub:
+    return websocket.app.state.price_hub
+
+
+def get_price_streams(websocket: 'WebSocket') -> Optional[PriceStreams]:
+    return websocket.app.state.price_streams
+
+
+async def ticker_price(
+    websocket: 'WebSocket',
+    price_hub: PriceHub = Depends(get_price_hub),
+    price_streams: Optional[PriceStreams] = Depends(get_price_streams),
+    settings: WebSocketSettings = Depends(get_websocket_settings),
+) -> None:
+    wire_format = negotiate_subprotocol(websocket.scope.get('subprotocols', []))
+    if wire_format is None:
+        await websocket.accept()
+    else:
+        await websocket.accept(subprotocol=wire_format.subprotocol)
+
+    with metrics.ACTIVE_WEBSOCKETS.track_inprogress():
+        await _track_prices(websocket, price_hub, price_streams, settings, wire_format or WireFormat.JSON)
+
+
+async def _track_prices(
+    websocket: 'WebSocket',
+    price_hub: PriceHub,
+    price_streams: Optional[PriceStreams],
+    settings: WebSocketSettings,
+    wire_format: WireFormat,
+) -> None:
+    first_message = await websocket.receive_text()
+    try:
+        command = TrackingCommand.parse_raw(first_message)
+    except ValueError:
+        if not re.match(TICKER_NAME_PATTERN, first_message):
+            logger.info('Got invalid ticker name, close websocket')
+            await websocket.close(code=WebSocketCloseCode.UNSUPPORTED_DATA)
+            return
+        await track_single_ticker(websocket, price_hub, ticker_name=first_message, wire_format=wire_format)
+    else:
+        await track_tickers(
+            websocket,
+            price_hub,
+            command,
+            batch_window=settings.batch_window,
+            max_tracked_tickers=settings.max_tracked_tickers,
+            wire_format=wire_format,
+            price_streams=price_streams,
+        )
+
+
+async def track_single_ticker(
+    websocket: 'WebSocket', price_hub: PriceHub, ticker_name: str, wire_format: WireFormat = WireFormat.JSON
+) -> None:
+    logger.info('Start tracking price updates for %s', ticker_name)
+
+    updates = price_hub.create_send_queue()
+    try:
+        await price_hub.subscribe(ticker_name, updates)
+        await listen_to_updates(updates, websocket, ticker_name, wire_format)
+    except RedisError:
+        logger.exception('Cannot subscribe to redis, stop tracking ticker %s', ticker_name)
+        await websocket.close(code=WebSocketCloseCode.TRY_AGAIN_LATER)
+    finally:
+        await price_hub.unsubscribe(ticker_name, updates)
+
+
+async def listen_to_updates(
+    updates: 'SendQueue', websocket: 'WebSocket', ticker_name: str, wire_format: WireFormat = WireFormat.JSON
+) -> None:
     while True:
+        update = await updates.get()
+
+        if isinstance(update, SubscriptionError):
+            logger.info('Stop tracking ticker %s: %s', ticker_name, update.value)
+            await websocket.close(code=_SUBSCRIPTION_ERROR_CLOSE_CODES[update])
+            break
+
+        _, price_info = update
         try:
-            raw_message = await _get_message(reader)
-        except RedisError:
-            logger.exception('Cannot read from redis, stop tracking ticker %s', ticker_name)
-            await websocket.close(code=WebSocketCloseCode.TRY_AGAIN_LATER)
+            if wire_format is WireFormat.JSON:
+                await websocket.send_text(price_info)
+            else:
+                await _send_frame(websocket, encode_messages(wire_format, [price_info]))
+            metrics.observe_delivery_lag(price_info)
+        except WebSocketException:
+            logger.info('Cannot send to websocket, stop tracking ticker %s', ticker_name)
             break
 
-        if not raw_message:
-            await asyncio.sleep(0.1)
-            continue
 
+async def track_tickers(
+    websocket: 'WebSocket',
+    price_hub: PriceHub,
+    command: TrackingCommand,
+    batch_window: float,
+    max_tracked_tickers: int,
+    wire_format: WireFormat = WireFormat.JSON,
+    price_streams: Optional[PriceStreams] = None,
+) -> None:
+    updates = price_hub.create_send_queue()
+    tracked_tickers: set[str] = set()
+    missed_updates = MissedUpdates(websocket, price_hub, price_streams, wire_format)
+    try:
+        if not await apply_tracking_command(
+            price_hub, updates, tracked_tickers, command, max_tracked_tickers, missed_updates
+        ):
+            await websocket.close(code=WebSocketCloseCode.POLICY_VIOLATION)
+            return
+        sender = asyncio.create_task(
+            send_batched_updates(updates, websocket, batch_window, wire_format, missed_updates)
+        )
+        receiver = asyncio.create_task(
+            receive_tracking_commands(
+                websocket, price_hub, updates, tracked_tickers, max_tracked_tickers, missed_updates
+            )
+        )
+        done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+    except RedisError:
+        logger.exception('Cannot subscribe to redis, stop tracking tickers')
+        await websocket.close(code=WebSocketCloseCode.TRY_AGAIN_LATER)
+    finally:
+        for ticker_name in tracked_tickers:
+            await price_hub.unsubscribe(ticker_name, updates)
+
+
+async def apply_tracking_command(
+    price_hub: PriceHub,
+    updates: 'SendQueue',
+    tracked_tickers: set[str],
+    command: TrackingCommand,
+    max_tracked_tickers: int,
+    missed_updates: Optional['MissedUpdates'] = None,
+) -> bool:
+    if command.action is TrackingAction.SUBSCRIBE:
+        new_tickers = set(command.tickers) - tracked_tickers
+        if len(tracked_tickers) + len(new_tickers) > max_tracked_tickers:
+            logger.info('Client tries to track more than %d tickers, close websocket', max_tracked_tickers)
+            return False
+        for ticker_name in new_tickers:
+            tracked_tickers.add(ticker_name)
+            await price_hub.subscribe(ticker_name, updates)
+        if missed_updates is not None:
+            for ticker_name in new_tickers & command.resume.keys():
+                await missed_updates.send(ticker_name, after_id=command.resume[ticker_name])
+    else:
+        for ticker_name in tracked_tickers & set(command.tickers):
+            tracked_tickers.remove(ticker_name)
+            await price_hub.unsubscribe(ticker_name, updates)
+    logger.info('Tracking %d tickers after %s', len(tracked_tickers), command.action.value)
+    return True
+
+
+async def receive_tracking_commands(
+    websocket: 'WebSocket',
+    price_hub: PriceHub,
+    updates: 'SendQueue',
+    tracked_tickers: set[str],
+    max_tracked_tickers: int,
+    missed_updates: 'MissedUpdates',
+) -> None:
+    while True:
         try:
-            message = RedisPriceMessage.parse_obj(raw_message)
+            command = TrackingCommand.parse_raw(await websocket.receive_text())
+        except WebSocketDisconnect:
+            break
         except ValueError:
-            logger.exception('Cannot parse redis price info, stop tracking ticker %s', ticker_name)
-            await websocket.close(code=WebSocketCloseCode.INTERNAL_ERROR)
+            logger.info('Got invalid tracking command, close websocket')
+            await websocket.close(code=WebSocketCloseCode.UNSUPPORTED_DATA)
+            break
+        # holding the send lock keeps live updates of resumed tickers from overtaking the replayed ones
+        async with missed_updates.send_lock:
+            applied = await apply_tracking_command(
+                price_hub, updates, tracked_tickers, command, max_tracked_tickers, missed_updates
+            )
+        if not applied:
+            await websocket.close(code=WebSocketCloseCode.POLICY_VIOLATION)
+            break
+
+
+async def send_batched_updates(
+    updates: 'SendQueue',
+    websocket: 'WebSocket',
+    batch_window: float,
+    wire_format: WireFormat = WireFormat.JSON,
+    missed_updates: Optional['MissedUpdates'] = None,
+) -> None:
+    while True:
+        update = await updates.get()
+        if isinstance(update, SubscriptionError):
+            logger.info('Stop tracking tickers: %s', update.value)
+            await websocket.close(code=_SUBSCRIPTION_ERROR_CLOSE_CODES[update])
             break
-        if message.type != 'message':
-            await asyncio.sleep(0.1)
-            continue
 
-        price_info = cast(TickerPrice, message.payload).encoded()
+        if batch_window > 0:
+            await asyncio.sleep(batch_window)
+        batch = [update, *updates.drain()]
         try:
-            await websocket.send_json(price_info)
+            if missed_updates is None:
+                await _send_frame(websocket, encode_messages(wire_format, [price_info for _, price_info in batch]))
+            else:
+                async with missed_updates.send_lock:
+                    messages = [
+                        price_info for name, price_info in batch if not missed_updates.was_sent(name, price_info)
+                    ]
+                    if messages:
+                        await _send_frame(websocket, encode_messages(wire_format, messages))
+            metrics.observe_delivery_lag(update[1])
         except WebSocketException:
-            logger.info('Cannot send to websocket, stop tracking ticker %s', ticker_name)
-            await reader.unsubscribe(ticker_name)
+            logger.info('Cannot send to websocket, stop tracking tickers')
             break
+
+
+async def _send_frame(websocket: 'WebSocket', frame: Union[str, bytes]) -> None:
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
+class MissedUpdates:
+    def __init__(
+        self,
+        websocket: 'WebSocket',
+        price_hub: PriceHub,
+        price_streams: Optional[PriceStreams],
+        wire_format: WireFormat,
+    ) -> None:
+        self.send_lock = asyncio.Lock()
+        self._websocket = websocket
+        self._price_hub = price_hub
+        self._price_streams = price_streams
+        self._wire_format = wire_format
+        self._last_sent_ids: dict[str, StreamId] = {}
+
+    async def send(self, ticker_name: str, after_id: str) -> None:
+        if self._price_streams is None:
+            return
+
+        messages = await self._price_streams.read_after(self._price_hub.redis, ticker_name, after_id)
+        logger.info('Replay %d missed updates for %s', len(messages), ticker_name)
+        for start in range(0, len(messages), _REPLAY_FRAME_SIZE):
+            await _send_frame(
+                self._websocket, encode_messages(self._wire_format, messages[start : start + _REPLAY_FRAME_SIZE])
+            )
+        last_sent_id = stream_id_of(messages[-1]) if messages else None
+        self._last_sent_ids[ticker_name] = last_sent_id or parse_stream_id(after_id)
+
+    def was_sent(self, ticker_name: str, message: str) -> bool:
+        last_sent_id = self._last_sent_ids.get(ticker_name)
+        if last_sent_id is None:
+            return False
+
+        stream_id = stream_id_of(message)
+        if stream_id is not None and stream_id <= last_sent_id:
+            return True
+        # live updates have caught up with the replay, so the rest of them are sent as they are
+        del self._last_sent_ids[ticker_name]
+        return False
@@ -1,25 +1,63 @@
 import asyncio
 import json
+import math
 import pathlib
-from datetime import datetime, timezone
+import pstats
+import struct
+import time
+from datetime import date, datetime, timedelta, timezone
 from decimal import Decimal
+from functools import partial
 from http import HTTPStatus
+from types import SimpleNamespace
 from uuid import uuid4
 
+import aioredis
 import pytest
 import sqlalchemy as sa
+import typer
 from aioredis import RedisError
 from fastapi.encoders import jsonable_encoder
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
 from starlette.templating import Jinja2Templates
 from starlette.websockets import WebSocketDisconnect
 
 import stock_prices.settings
-from stock_prices import db
+from stock_prices import bench, db, history, partitions
 from stock_prices.app import get_app
-from stock_prices.cli import _update_prices
-from stock_prices.models import RedisPriceMessage
-from stock_prices.views import WebSocketCloseCode, get_redis, get_template
+from stock_prices.cli import (
+    Shard,
+    _bench,
+    _observe_tick,
+    _parse_shard,
+    _parse_tier,
+    _publish,
+    _update_prices,
+    _warm_recent_prices,
+    backfill_candles,
+    fill_db,
+    manage_partitions,
+)
+from stock_prices.downsampling import largest_triangle_three_buckets
+from stock_prices.formats import WireFormat, epoch_ms
+from stock_prices.hub import OverflowPolicy, PriceHub, SendQueue, SubscriptionError
+from stock_prices.latest_prices import LatestPrices, load_latest_prices
+from stock_prices.models import RedisPriceMessage, TickerPrice
+from stock_prices.profiling import Profiler, log_slow_queries
+from stock_prices.recent_prices import RecentPrice, RecentPrices, select_recent
+from stock_prices.scheduler import DueTickers, TickerScheduler, Tier
+from stock_prices.settings import DBSettings, RedisSettings
+from stock_prices.streams import PriceStreams, with_stream_id
+from stock_prices.views import (
+    MissedUpdates,
+    WebSocketCloseCode,
+    get_app_redis,
+    get_redis,
+    get_template,
+    get_websocket_settings,
+)
 
 
 @pytest.fixture()
@@ -28,11 +66,17 @@ def redis_client():
 
 
 @pytest.fixture()
-def client():
+def app():
     static_path = pathlib.Path(__file__).parent.parent / 'static'
     app = get_app(static_directory=static_path)
     app.dependency_overrides[get_template] = lambda: Jinja2Templates(static_path / 'templates')
-    return TestClient(app)
+    return app
+
+
+@pytest.fixture()
+def client(app):
+    with TestClient(app) as client:
+        yield client
 
 
 @pytest.fixture()
@@ -42,10 +86,18 @@ def price_update(request):
 
 @pytest.fixture()
 def _mock_redis_channel(price_update, mocker):
-    message = {'type': 'message', 'data': json.dumps(jsonable_encoder(price_update))}
+    message = {'type': 'message', 'channel': 'some-ticker', 'data': json.dumps(jsonable_encoder(price_update))}
 
-    _get_message = mocker.patch('stock_prices.views._get_message')
-    _get_message.side_effect = [message, RedisError()]
+    messages = [message, RedisError()]
+
+    async def _get_message(reader):
+        while not messages or 'some-ticker' not in reader.channels:
+            await asyncio.sleep(0.01)
+        if isinstance(next_message := messages.pop(0), Exception):
+            raise next_message
+        return next_message
+
+    mocker.patch('stock_prices.hub._get_message', side_effect=_get_message)
 
 
 @pytest.fixture(autouse=True)
@@ -60,23 +112,98 @@ def _prepare_db():
     db.Base.metadata.drop_all()
 
 
-def _create_ticker_price(prices):
-    ticker_name = str(uuid4())
+def _create_ticker_price(prices, ticker_name=None):
+    ticker_name = ticker_name or str(uuid4())
     with db.create_session() as session:
         ticker = db.Ticker(name=ticker_name)
         ticker_prices = [
             db.TickerPrice(ticker=ticker, price=price, created_at=created_at) for created_at, price in prices.items()
         ]
         session.add_all((ticker, *ticker_prices))
+        if ticker_prices:
+            session.flush()
+            last_price = ticker_prices[-1]
+            ticker.last_price = db.TickerLastPrice(
+                price_id=last_price.id, price=last_price.price, created_at=last_price.created_at
+            )
     return ticker_name
 
 
-def test_homepage(client):
-    ticker_name = _create_ticker_price(prices={})
+def test_prices_are_stored_as_scaled_integers():
+    ticker_name = _create_ticker_price(prices={datetime(2022, 3, 1, tzinfo=timezone.utc): Decimal('12.34567')})
+
+    with db.create_session() as session:
+        stored = session.execute(sa.text('SELECT price FROM ticker_price')).scalar()
+        ticker = session.query(db.Ticker).filter(db.Ticker.name == ticker_name).one()
+        loaded = ticker.prices[0].price
+
+    assert stored == 123457
+    assert loaded == Decimal('12.3457')
+
+
+def test_db_settings_configure_both_engines():
+    settings = stock_prices.settings.DBSettings(url='postgresql://user@db:5432/prices', pool_size=2, max_overflow=3)
+
+    settings.setup()
+
+    sync_engine, async_engine = db.Session.kw['bind'], db.AsyncSession.kw['bind']
+    assert str(async_engine.url) == 'postgresql+asyncpg://user@db:5432/prices'
+    assert (sync_engine.pool.size(), async_engine.pool.size()) == (2, 2)
+    assert async_engine.sync_engine.pool._max_overflow == 3
+    assert async_engine.sync_engine.pool._pre_ping
+
+
+def test_redis_settings_create_bounded_pool():
+    redis = stock_prices.settings.RedisSettings(max_connections=3, pool_timeout=0.5).create_redis()
+
+    assert isinstance(redis.connection_pool, aioredis.BlockingConnectionPool)
+    assert (redis.connection_pool.max_connections, redis.connection_pool.timeout) == (3, 0.5)
 
-    response = client.get('/')
+
+def test_homepage(app):
+    ticker_names = sorted(_create_ticker_price(prices={}) for _ in range(3))
+
+    with TestClient(app) as client:
+        response = client.get('/')
     assert response.status_code == HTTPStatus.OK
-    assert ticker_name in response.text
+    assert ticker_names[0] in response.text
+    assert ticker_names[1] not in response.text
+
+
+def test_search_tickers(app):
+    for name in ('AAPL', 'AMZN', 'GOOG', 'MSFT', 'XYZ.A'):
+        _create_ticker_price(prices={}, ticker_name=name)
+
+    with TestClient(app) as client:
+        first_page = client.get('/tickers', params={'q': 'a', 'limit': 2})
+        second_page = client.get(
+            '/tickers', params={'q': 'a', 'limit': 2, 'cursor': first_page.headers['X-Next-Cursor']}
+        )
+        prefix = client.get('/tickers', params={'q': 'a', 'prefix': True})
+        everything = client.get('/tickers')
+
+    assert first_page.json() == ['AAPL', 'AMZN']
+    assert second_page.json() == ['XYZ.A']
+    assert 'X-Next-Cursor' not in second_page.headers
+    assert prefix.json() == ['AAPL', 'AMZN']
+    assert everything.json() == ['AAPL', 'AMZN', 'GOOG', 'MSFT', 'XYZ.A']
+
+
+def test_fill_db_announces_new_tickers(client):
+    _wait_for_subscribers(**{RedisSettings().tickers_channel: 1})
+
+    fill_db(tickers=3, history_days=0.0, tick_interval=1.0)
+
+    _wait_until(
+        lambda: client.get('/tickers', params={'q': 'ticker_'}).json() == ['ticker_00', 'ticker_01', 'ticker_02']
+    )
+
+
+def test_fill_db_without_tickers_does_nothing():
+    fill_db(tickers=0, history_days=1.0, tick_interval=60.0)
+
+    with db.create_session() as session:
+        assert session.execute(sa.select(sa.func.count()).select_from(db.Ticker)).scalar() == 0
 
 
 def test_get_ticker_price(client):
@@ -89,6 +216,261 @@ def test_get_ticker_price(client):
     assert [(p['name'], p['price']) for p in response.json()] == [(ticker_name, p) for p in range(1, 16)]
 
 
+def test_get_ticker_price_range_and_pages(client):
+    ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=d): d for d in range(1, 16)})
+    params = {'ticker_name': ticker_name, 'from': '2022-03-03T00:00:00', 'to': '2022-03-10T00:00:00', 'limit': 4}
+
+    first_page = client.get('/ticker-price', params=params)
+    second_page = client.get('/ticker-price', params={**params, 'cursor': first_page.headers['X-Next-Cursor']})
+
+    assert [p['price'] for p in first_page.json()] == [3, 4, 5, 6]
+    assert [p['price'] for p in second_page.json()] == [7, 8, 9]
+    assert 'X-Next-Cursor' not in second_page.headers
+
+
+def test_metrics(client):
+    ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=1): 1})
+    client.get('/ticker-price', params={'ticker_name': ticker_name})
+
+    with client.websocket_connect('/track-price') as websocket:
+        websocket.send_json({'action': 'subscribe', 'tickers': ['ticker_m']})
+        _wait_until(lambda: client.app.state.price_hub.subscriptions == {'ticker_m': 1})
+        response = client.get('/metrics')
+
+    assert response.status_code == HTTPStatus.OK
+    samples = {
+        (sample.name, tuple(sample.labels.items())): sample.value
+        for family in text_string_to_metric_families(response.text)
+        for sample in family.samples
+    }
+    assert samples[('stock_prices_active_websockets', ())] == 1
+    assert samples[('stock_prices_subscriptions', ())] == 1
+    assert samples[('stock_prices_send_queue_depth', (('aggregate', 'max'),))] == 0
+    assert samples[('stock_prices_history_query_duration_seconds_count', (('mode', 'raw'),))] >= 1
+    assert samples[('stock_prices_redis_pool_connections', (('state', 'max'),))] == RedisSettings().max_connections
+    # the pubsub reader of the price hub keeps one connection
+    assert samples[('stock_prices_redis_pool_connections', (('state', 'in_use'),))] >= 1
+    assert samples[('stock_prices_db_pool_connections', (('state', 'size'),))] == DBSettings().pool_size
+
+
+def test_app_shares_one_redis_client(client):
+    redis = client.app.state.redis
+
+    assert client.app.state.price_hub.redis is redis
+    assert get_app_redis(SimpleNamespace(app=client.app)) is redis
+
+
+def test_observe_tick():
+    overruns = REGISTRY.get_sample_value('stock_prices_tick_overruns_total') or 0
+    ticks = REGISTRY.get_sample_value('stock_prices_tick_duration_seconds_count') or 0
+
+    _observe_tick(update_duration=0.5, publish_duration=0.6, interval=1.0)
+    _observe_tick(update_duration=0.1, publish_duration=0.1, interval=1.0)
+
+    assert REGISTRY.get_sample_value('stock_prices_tick_overruns_total') == overruns + 1
+    assert REGISTRY.get_sample_value('stock_prices_tick_duration_seconds_count') == ticks + 2
+
+
+def test_profile_sampled_requests(monkeypatch, tmp_path):
+    monkeypatch.setenv('PROFILING_ENABLED', 'true')
+    monkeypatch.setenv('PROFILING_DIRECTORY', str(tmp_path))
+    monkeypatch.setenv('PROFILING_REQUEST_SAMPLE_RATE', '1')
+    static_path = pathlib.Path(__file__).parent.parent / 'static'
+
+    with TestClient(get_app(static_directory=static_path)) as client:
+        client.get('/ticker-price', params={'ticker_name': 'unknown'})
+
+    [profile_path] = tmp_path.glob('*-request_ticker-price.pstats')
+    assert pstats.Stats(str(profile_path)).total_calls > 0
+
+
+def test_profile_every_nth_tick(tmp_path):
+    _create_ticker_price(prices={datetime(year=2022, month=3, day=1): 1})
+    profiler = Profiler(tmp_path, max_files=2)
+
+    for _ in range(7):
+        _update_prices(price_diff_generator=lambda: 1, tick_hook=partial(profiler.every, 2, 'tick'))
+
+    assert len(list(tmp_path.glob('*-tick.pstats'))) == 2
+
+
+def test_log_slow_queries(caplog):
+    log_slow_queries(0)
+    try:
+        with db.create_session() as session:
+            session.execute(sa.text('SELECT pg_sleep(0.01)'))
+    finally:
+        log_slow_queries(None)
+
+    assert any('Slow query' in message and 'pg_sleep' in message for message in caplog.messages)
+
+
+def test_get_ticker_price_delta(client):
+    ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=d): d for d in range(1, 6)})
+    with db.create_session() as session:
+        ticker = session.query(db.Ticker).filter(db.Ticker.name == ticker_name).one()
+        price_ids = [p.id for p in ticker.prices]
+
+    full = client.get('/ticker-price', params={'ticker_name': ticker_name})
+    delta = client.get('/ticker-price', params={'ticker_name': ticker_name, 'after_id': price_ids[2]})
+    since = client.get('/ticker-price', params={'ticker_name': ticker_name, 'since': '2022-03-03T00:00:00'})
+
+    assert full.headers['X-Last-Id'] == str(price_ids[-1])
+    assert [p['price'] for p in delta.json()] == [4, 5]
+    assert delta.headers['X-Last-Id'] == str(price_ids[-1])
+    assert [p['price'] for p in since.json()] == [4, 5]
+
+
+def test_get_ticker_price_not_modified(client):
+    ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=d): d for d in range(1, 3)})
+    params = {'ticker_name': ticker_name, 'resolution': 10}
+
+    first = client.get('/ticker-price', params=params)
+    etag = {'If-None-Match': first.headers['ETag']}
+    cached = client.get('/ticker-price', params=params, headers=etag)
+    other_query = client.get('/ticker-price', params={'ticker_name': ticker_name}, headers=etag)
+    _update_prices(price_diff_generator=lambda: 1)
+    updated = client.get('/ticker-price', params=params, headers=etag)
+
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert cached.status_code == HTTPStatus.NOT_MODIFIED
+    assert cached.headers['ETag'] == first.headers['ETag']
+    assert other_query.status_code == HTTPStatus.OK
+    assert updated.status_code == HTTPStatus.OK
+    assert updated.headers['ETag'] != first.headers['ETag']
+    assert [p['price'] for p in updated.json()] == [1, 2, 3]
+
+
+def test_get_ticker_price_from_recent_prices(client, redis_client, monkeypatch):
+    recent_prices = RecentPrices(prefix=f'test-recent-{uuid4()}:', max_len=3)
+    monkeypatch.setattr(client.app.state, 'recent_prices', recent_prices)
+    ticker_name = _create_ticker_price(prices={datetime(2022, 3, d, tzinfo=timezone.utc): d for d in range(1, 4)})
+
+    async def _warm_and_publish():
+        async with redis_client:
+            await _warm_recent_prices(redis_client, recent_prices)
+            await _publish(redis_client, _update_prices(price_diff_generator=lambda: 1), recent_prices=recent_prices)
+
+    asyncio.run(_warm_and_publish())
+    with db.create_session() as session:
+        ticker = session.query(db.Ticker).filter(db.Ticker.name == ticker_name).one()
+        price_ids = [p.id for p in ticker.prices]
+        # the newest price is left only in the buffer to tell which of them has answered
+        session.query(db.TickerPrice).filter(db.TickerPrice.id == price_ids[-1]).delete()
+
+    delta = client.get('/ticker-price', params={'ticker_name': ticker_name, 'after_id': price_ids[1]})
+    since = client.get('/ticker-price', params={'ticker_name': ticker_name, 'since': '2022-03-02T12:00:00'})
+    page = client.get('/ticker-price', params={'ticker_name': ticker_name, 'cursor': price_ids[1], 'limit': 1})
+    older = client.get('/ticker-price', params={'ticker_name': ticker_name, 'after_id': price_ids[0]})
+
+    assert [p['price'] for p in delta.json()] == [3, 4]
+    assert delta.headers['X-Last-Id'] == str(price_ids[-1])
+    assert [p['price'] for p in since.json()] == [3, 4]
+    assert [p['price'] for p in page.json()] == [3]
+    assert page.headers['X-Next-Cursor'] == str(price_ids[2])
+    assert [p['price'] for p in older.json()] == [2, 3]
+
+
+def test_select_recent_prices_only_when_covered():
+    prices = [RecentPrice(i, datetime(2022, 3, i, tzinfo=timezone.utc), Decimal(i)) for i in range(2, 5)]
+
+    assert select_recent(prices) is None
+    assert select_recent(prices, after_id=1) is None
+    assert select_recent(prices, from_=datetime(2022, 3, 2)) is None
+    assert select_recent(prices, after_id=2) == prices[1:]
+    assert select_recent(prices, from_=datetime(2022, 3, 3), to=datetime(2022, 3, 4)) == prices[1:2]
+    assert select_recent([], after_id=2) is None
+
+
+@pytest.mark.parametrize('accept', ['application/json', 'application/x-ndjson'])
+def test_get_ticker_price_streamed(client, mocker, accept):
+    mocker.patch('stock_prices.views._STREAM_CHUNK_SIZE', 2)
+    ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=d): d for d in range(1, 8)})
+    params = {'ticker_name': ticker_name, 'limit': 5}
+
+    regular = client.get('/ticker-price', params=params)
+    streamed = client.get('/ticker-price', params={**params, 'stream': True}, headers={'Accept': accept})
+
+    assert streamed.status_code == HTTPStatus.OK
+    assert streamed.headers['content-type'] == accept
+    assert streamed.headers['X-Next-Cursor'] == regular.headers['X-Next-Cursor']
+    if accept == 'application/x-ndjson':
+        assert [json.loads(line) for line in streamed.text.splitlines()] == regular.json()
+    else:
+        assert streamed.json() == regular.json()
+
+
+def test_get_ticker_price_streamed_empty(client):
+    params = {'ticker_name': 'unknown', 'stream': True}
+
+    assert client.get('/ticker-price', params=params).json() == []
+    assert client.get('/ticker-price', params=params, headers={'Accept': 'application/x-ndjson'}).text == ''
+
+
+def test_get_ticker_price_compact_formats(client):
+    prices = {datetime(year=2022, month=3, day=d, tzinfo=timezone.utc): d for d in range(1, 5)}
+    prices[datetime(year=2022, month=3, day=5, tzinfo=timezone.utc)] = None
+    ticker_name = _create_ticker_price(prices=prices)
+    params = {'ticker_name': ticker_name}
+    expected_t, expected_p = [epoch_ms(created_at) for created_at in prices], list(prices.values())
+
+    columnar = client.get('/ticker-price', params=params, headers={'Accept': WireFormat.COLUMNAR.media_type})
+    packed = client.get('/ticker-price', params=params, headers={'Accept': WireFormat.PACKED.media_type})
+
+    assert columnar.headers['content-type'] == WireFormat.COLUMNAR.media_type
+    assert columnar.headers['Vary'] == 'Accept'
+    assert columnar.json() == {'name': ticker_name, 't': expected_t, 'p': expected_p}
+    name_length = struct.unpack_from('<H', packed.content)[0]
+    name, count = struct.unpack_from(f'<{name_length}sI', packed.content, 2)
+    t_p = struct.unpack_from(f'<{count}q{count}d', packed.content, 2 + name_length + 4)
+    assert name.decode() == ticker_name
+    assert list(t_p[:count]) == expected_t
+    assert t_p[count:-1] == tuple(expected_p[:-1]) and math.isnan(t_p[-1])
+
+
+def test_get_ticker_price_downsampled(client):
+    prices = {datetime(year=2022, month=3, day=1, minute=m): 10 if m == 42 else m % 2 for m in range(60)}
+    ticker_name = _create_ticker_price(prices=prices)
+
+    response = client.get('/ticker-price', params={'ticker_name': ticker_name, 'resolution': 10})
+
+    downsampled = response.json()
+    assert len(downsampled) == 10
+    assert downsampled[0]['created_at'].startswith('2022-03-01T00:00:00')
+    assert downsampled[-1]['created_at'].startswith('2022-03-01T00:59:00')
+    assert 10 in [p['price'] for p in downsampled]
+
+
+def test_get_ticker_price_downsampled_reads_bounded_rows(client, mocker):
+    prices = {
+        datetime(year=2022, month=3, day=1, minute=m, second=s): m + s for m in range(60) for s in range(0, 60, 6)
+    }
+    prices[datetime(year=2022, month=3, day=1, minute=30, second=1)] = None
+    ticker_name = _create_ticker_price(prices=prices)
+    lttb = mocker.patch(
+        'stock_prices.views.largest_triangle_three_buckets', side_effect=largest_triangle_three_buckets
+    )
+
+    response = client.get('/ticker-price', params={'ticker_name': ticker_name, 'resolution': 20})
+
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.json()) == 20
+    assert len(lttb.call_args.args[0]) <= 2 * 20 + 2
+    assert None not in [p['price'] for p in response.json()]
+
+
+def test_largest_triangle_three_buckets():
+    points = [(0, 0), (1, 1), (2, 0), (3, 5), (4, 0), (5, 1), (6, 0)]
+
+    sampled = largest_triangle_three_buckets(points, threshold=4, x=lambda p: p[0], y=lambda p: p[1])
+
+    assert sampled[0] == (0, 0)
+    assert sampled[-1] == (6, 0)
+    assert (3, 5) in sampled
+    assert len(sampled) == 4
+    assert largest_triangle_three_buckets(points, threshold=10, x=lambda p: p[0], y=lambda p: p[1]) == points
+
+
 @pytest.mark.parametrize(
     'price_update',
     [{'price': 15, 'created_at': datetime(year=2022, month=3, day=1), 'name': 'some-ticker'}],
@@ -108,22 +490,267 @@ def test_track_price_websocket(client, redis_client, price_update):
 
 @pytest.mark.parametrize(
     'price_update',
-    [{'price': 15, 'created_at': datetime(year=2022, month=3, day=1)}],
+    [{'name': 'some-ticker', 'price': 15.5, 'created_at': datetime(year=2022, month=3, day=1)}],
     indirect=True,
 )
 @pytest.mark.usefixtures('_mock_redis_channel')
-def test_track_price_invalid_message(client, redis_client, price_update):
+def test_track_price_forwards_published_message(client, redis_client, price_update):
     with client.websocket_connect('/track-price') as websocket:
         websocket.send_text('some-ticker')
+        assert websocket.receive_text() == json.dumps(jsonable_encoder(price_update))
+
+
+@pytest.mark.parametrize(
+    'price_update',
+    [{'name': 'some-ticker', 'price': 15.5, 'created_at': datetime(2022, 3, 1, tzinfo=timezone.utc)}],
+    indirect=True,
+)
+@pytest.mark.usefixtures('_mock_redis_channel')
+def test_track_price_columnar_subprotocol(client, redis_client, price_update):
+    with client.websocket_connect('/track-price', subprotocols=[WireFormat.COLUMNAR.subprotocol]) as websocket:
+        assert websocket.accepted_subprotocol == WireFormat.COLUMNAR.subprotocol
+        websocket.send_json({'action': 'subscribe', 'tickers': ['some-ticker']})
+
+        assert websocket.receive_json() == [
+            {'name': 'some-ticker', 't': [epoch_ms(price_update['created_at'])], 'p': [15.5]}
+        ]
+
+
+def test_ticker_price_encoded_matches_json_encoder():
+    price = TickerPrice(name='ticker_a', price=Decimal('1.25'), created_at=datetime(2022, 3, 1, tzinfo=timezone.utc))
+
+    assert price.encoded() == jsonable_encoder(price)
+
+
+@pytest.mark.asyncio
+async def test_bench_dispatch():
+    rates = await bench.bench_dispatch(tickers=10, subscribers=2)
+
+    assert set(rates) == {'reencode', 'raw'}
+    assert all(rate > 0 for rate in rates.values())
+
+
+@pytest.mark.asyncio
+async def test_bench_load(mocker):
+    mocker.patch('stock_prices.bench._DELIVERY_DRAIN_TIME', 0.2)
+    ticker_names = [_create_ticker_price(prices={}) for _ in range(2)]
+
+    results = await _bench(ticker_names, clients=2, rate=10, duration=1, url=None)
+
+    assert results['generator']['ticks_per_second'] > 0
+    assert results['history']['requests'] > 0
+    assert results['delivery_lag']['messages'] > 0
+    assert 0 <= results['delivery_lag']['p50'] <= results['delivery_lag']['p99']
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def _wait_for_subscribers(**expected_subscribers):
+    async def _subscribers():
+        redis = await get_redis()
+        subscribers = dict(await redis.pubsub_numsub(*expected_subscribers))
+        await redis.connection_pool.disconnect()
+        return subscribers
+
+    _wait_until(lambda: asyncio.run(_subscribers()) == expected_subscribers)
+
+
+def test_track_multiple_tickers_websocket(client):
+    def publish(*prices):
+        async def _publish_prices():
+            redis = await get_redis()
+            await _publish(
+                redis, [TickerPrice(name=n, price=p, created_at=datetime.now(timezone.utc)) for n, p in prices]
+            )
+            await redis.connection_pool.disconnect()
+
+        asyncio.run(_publish_prices())
+
+    with client.websocket_connect('/track-price') as websocket:
+        websocket.send_json({'action': 'subscribe', 'tickers': ['ticker_a', 'ticker_b']})
+        _wait_for_subscribers(ticker_a=1, ticker_b=1)
+        publish(('ticker_a', 1), ('ticker_b', 2), ('ticker_c', 3))
+        assert sorted((p['name'], p['price']) for p in websocket.receive_json()) == [('ticker_a', 1), ('ticker_b', 2)]
+
+        websocket.send_json({'action': 'unsubscribe', 'tickers': ['ticker_a']})
+        _wait_for_subscribers(ticker_a=0, ticker_b=1)
+        publish(('ticker_a', 4), ('ticker_b', 5))
+        assert [(p['name'], p['price']) for p in websocket.receive_json()] == [('ticker_b', 5)]
+
+        websocket.send_text('{"action": "unknown"}')
+        with pytest.raises(WebSocketDisconnect) as error:
+            websocket.receive_json()
+        assert error.value.code == WebSocketCloseCode.UNSUPPORTED_DATA
+
+
+def test_track_tickers_resumes_from_stream(client, monkeypatch):
+    streams = PriceStreams(prefix=f'test-stream-{uuid4()}:', max_len=100)
+    monkeypatch.setattr(client.app.state, 'price_streams', streams)
+
+    def publish(*prices):
+        async def _publish_prices():
+            redis = await get_redis()
+            created_at = datetime.now(timezone.utc)
+            await _publish(
+                redis, [TickerPrice(name='ticker_r', price=p, created_at=created_at) for p in prices], streams=streams
+            )
+            entries = await redis.xrange(streams.key('ticker_r'))
+            await redis.expire(streams.key('ticker_r'), 60)
+            await redis.connection_pool.disconnect()
+            return [entry_id for entry_id, _ in entries]
+
+        return asyncio.run(_publish_prices())
+
+    stream_ids = publish(1, 2, 3)
+    with client.websocket_connect('/track-price') as websocket:
+        websocket.send_json({'action': 'subscribe', 'tickers': ['ticker_r'], 'resume': {'ticker_r': stream_ids[0]}})
+        replayed = websocket.receive_json()
+        assert [(p['id'], p['price']) for p in replayed] == [(stream_ids[1], 2), (stream_ids[2], 3)]
+
+        _wait_for_subscribers(ticker_r=1)
+        stream_ids = publish(4)
+        assert [(p['id'], p['price']) for p in websocket.receive_json()] == [(stream_ids[-1], 4)]
+
+
+@pytest.mark.asyncio
+async def test_missed_updates_skip_replayed_live_updates(mocker):
+    redis = await get_redis()
+    streams = PriceStreams(prefix=f'test-stream-{uuid4()}:', max_len=100)
+    messages = await streams.add(redis, [('ticker_a', json.dumps({'name': 'ticker_a', 'price': p})) for p in range(4)])
+    websocket = mocker.AsyncMock()
+    missed_updates = MissedUpdates(websocket, mocker.Mock(redis=redis), streams, WireFormat.JSON)
+
+    await missed_updates.send('ticker_a', after_id=json.loads(messages[0])['id'])
+    await redis.delete(streams.key('ticker_a'))
+    await redis.connection_pool.disconnect()
+
+    websocket.send_text.assert_awaited_once_with(f'[{",".join(messages[1:])}]')
+    assert [missed_updates.was_sent('ticker_a', message) for message in messages[2:]] == [True, True]
+    assert not missed_updates.was_sent('ticker_b', messages[3])
+    live_message = with_stream_id('99999999999999-0', json.dumps({'name': 'ticker_a', 'price': 4}))
+    assert not missed_updates.was_sent('ticker_a', live_message)
+    assert not missed_updates.was_sent('ticker_a', messages[3])
+
+
+@pytest.mark.parametrize(
+    ('messages', 'close_code'),
+    [
+        (['stock-prices:board'], WebSocketCloseCode.UNSUPPORTED_DATA),
+        (['{"action": "subscribe", "tickers": ["bad name"]}'], WebSocketCloseCode.UNSUPPORTED_DATA),
+        (['{"action": "subscribe", "tickers": ["a", "b", "c"]}'], WebSocketCloseCode.POLICY_VIOLATION),
+        (
+            ['{"action": "subscribe", "tickers": ["a", "b"]}', '{"action": "subscribe", "tickers": ["c"]}'],
+            WebSocketCloseCode.POLICY_VIOLATION,
+        ),
+    ],
+)
+def test_track_tickers_rejects_invalid_subscriptions(client, monkeypatch, messages, close_code):
+    monkeypatch.setattr(get_websocket_settings(), 'max_tracked_tickers', 2)
+
+    with client.websocket_connect('/track-price') as websocket:
+        for message in messages:
+            websocket.send_text(message)
         with pytest.raises(WebSocketDisconnect) as error:
             websocket.receive_json()
-        assert error.value.code == WebSocketCloseCode.INTERNAL_ERROR
+        assert error.value.code == close_code
+    _wait_until(lambda: client.app.state.price_hub.subscriptions == {})
+
+
+@pytest.mark.asyncio
+async def test_price_hub_fans_out_single_subscription():
+    hub = PriceHub(redis_factory=get_redis)
+    await hub.start()
+    first, second = hub.create_send_queue(), hub.create_send_queue()
+    await hub.subscribe('ticker_a', first)
+    await hub.subscribe('ticker_a', second)
+    assert hub.subscriptions == {'ticker_a': 2}
+
+    price = TickerPrice(name='ticker_a', price=1, created_at=datetime(year=2022, month=3, day=1, tzinfo=timezone.utc))
+    redis = await get_redis()
+    await _publish(redis, [price])
+    updates = [await asyncio.wait_for(queue.get(), timeout=1) for queue in (first, second)]
+    assert updates == [('ticker_a', json.dumps(price.encoded()))] * 2
+
+    await hub.unsubscribe('ticker_a', first)
+    assert hub.subscriptions == {'ticker_a': 1}
+    await hub.unsubscribe('ticker_a', second)
+    assert hub.subscriptions == {}
+    assert await redis.pubsub_numsub('ticker_a') == [('ticker_a', 0)]
+
+    await hub.stop()
+    await redis.connection_pool.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_price_hub_failed_subscribe_notifies_waiting_queues(mocker):
+    hub = PriceHub(redis_factory=get_redis)
+    await hub.start()
+    subscribe_called = asyncio.Event()
+
+    async def _subscribe(*channels):
+        subscribe_called.set()
+        await asyncio.sleep(0.01)
+        raise RedisError()
+
+    mocker.patch.object(hub._reader, 'subscribe', side_effect=_subscribe)
+    first, second = hub.create_send_queue(), hub.create_send_queue()
+    first_subscription = asyncio.create_task(hub.subscribe('ticker_a', first))
+    await subscribe_called.wait()
+    await hub.subscribe('ticker_a', second)
+
+    with pytest.raises(RedisError):
+        await first_subscription
+    assert hub.subscriptions == {}
+    assert await asyncio.wait_for(second.get(), timeout=1) is SubscriptionError.REDIS_UNAVAILABLE
+    assert len(first) == 0
+
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_price_hub_logs_listener_crash(mocker, caplog):
+    mocker.patch('stock_prices.hub._get_message', side_effect=RuntimeError('boom'))
+    hub = PriceHub(redis_factory=get_redis)
+    await hub.start()
+
+    await hub.subscribe('ticker_a', hub.create_send_queue())
+    await asyncio.sleep(0.01)
+
+    assert 'Price updates listener has crashed' in caplog.text
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ('overflow_policy', 'expected'),
+    [
+        (OverflowPolicy.CONFLATE, [('a', {'price': 3}), ('b', {'price': 2}), ('c', {'price': 1})]),
+        (OverflowPolicy.DROP_OLDEST, [('a', {'price': 2}), ('b', {'price': 2}), ('a', {'price': 3})]),
+        (OverflowPolicy.DISCONNECT, [SubscriptionError.SLOW_CONSUMER]),
+    ],
+)
+async def test_send_queue_overflow(overflow_policy, expected):
+    queue = SendQueue(maxsize=3, overflow_policy=overflow_policy)
+    for ticker_name, price in [('a', 1), ('b', 1), ('a', 2), ('b', 2), ('a', 3)]:
+        queue.put(ticker_name, {'price': price})
+    if overflow_policy is OverflowPolicy.CONFLATE:
+        queue.put('c', {'price': 1})
+
+    received = []
+    for _ in expected:
+        received.append(await asyncio.wait_for(queue.get(), timeout=1))
+    assert received == expected
 
 
 def test_generate_first_price():
     ticker_name = _create_ticker_price(prices={})
 
-    _update_prices(price_diff_generator=lambda: 1, publish=False)
+    _update_prices(price_diff_generator=lambda: 1)
 
     with db.create_session() as session:
         ticker: db.Ticker = session.query(db.Ticker).filter(db.Ticker.name == ticker_name).one()
@@ -136,13 +763,346 @@ def test_update_prices():
     ticker_name1 = _create_ticker_price(prices={datetime(year=2022, month=3, day=1): t1_price})
     ticker_name2 = _create_ticker_price(prices={datetime(year=2022, month=3, day=1): t2_price})
 
-    _update_prices(price_diff_generator=lambda: 1, publish=False)
+    _update_prices(price_diff_generator=lambda: 1)
 
     with db.create_session() as session:
         for name, initial_price in zip([ticker_name1, ticker_name2], [t1_price, t2_price]):
             ticker: db.Ticker = session.query(db.Ticker).filter(db.Ticker.name == name).one()
             assert len(ticker.prices) == 2
             assert [p.price for p in ticker.prices] == [Decimal(initial_price), Decimal(initial_price + 1)]
+            assert ticker.last_price.price_id == ticker.prices[-1].id
+            assert ticker.last_price.price == Decimal(initial_price + 1)
+
+
+def test_update_prices_by_shards():
+    ticker_names = {_create_ticker_price(prices={datetime(year=2022, month=3, day=1): 1}) for _ in range(5)}
+
+    sharded = [
+        {price.name for price in _update_prices(price_diff_generator=lambda: 1, shard=Shard(number, 2))}
+        for number in range(2)
+    ]
+
+    assert sharded[0] | sharded[1] == ticker_names
+    assert not sharded[0] & sharded[1]
+
+
+@pytest.mark.parametrize('value', ['1', '1/x', '2/2', '-1/2'])
+def test_parse_shard_rejects_invalid_values(value):
+    with pytest.raises(typer.BadParameter):
+        _parse_shard(value)
+
+
+@pytest.mark.parametrize('value', ['x=', '=1', '[=1', 'x=0'])
+def test_parse_tier_rejects_invalid_values(value):
+    with pytest.raises(typer.BadParameter):
+        _parse_tier(value)
+
+
+def test_update_prices_of_given_tickers():
+    ticker_names = [_create_ticker_price(prices={datetime(year=2022, month=3, day=1): 1}) for _ in range(3)]
+    with db.create_session() as session:
+        ticker_id = session.execute(sa.select(db.Ticker.id).where(db.Ticker.name == ticker_names[1])).scalar()
+
+    prices = _update_prices(price_diff_generator=lambda: 1, ticker_ids=[ticker_id])
+
+    assert [price.name for price in prices] == [ticker_names[1]]
+
+
+def test_scheduler_batches_due_tickers_by_tier():
+    scheduler = TickerScheduler(default_interval=1.0, tiers=[Tier('hot_.*', 0.25)])
+    scheduler.sync([(1, 'hot_a'), (2, 'cold_b'), (3, 'hot_c')], now=0)
+
+    batches = [sorted(scheduler.pop_due(now=i * 0.25).ticker_ids) for i in range(5)]
+
+    assert batches == [[1, 2, 3], [1, 3], [1, 3], [1, 3], [1, 2, 3]]
+    assert scheduler.next_due_at() == 1.25
+
+
+def test_scheduler_compensates_drift_and_counts_missed_updates():
+    scheduler = TickerScheduler(default_interval=1.0)
+    scheduler.sync([(1, 'a')], now=0)
+    scheduler.pop_due(now=0)
+
+    late = scheduler.pop_due(now=1.3)
+    behind = scheduler.pop_due(now=4.5)
+
+    assert late == DueTickers([1], missed=0)
+    assert behind == DueTickers([1], missed=2)
+    assert scheduler.next_due_at() == 5.0
+
+
+def test_scheduler_syncs_tickers():
+    scheduler = TickerScheduler(default_interval=1.0)
+    scheduler.sync([(1, 'a'), (2, 'b')], now=0)
+    scheduler.pop_due(now=0)
+
+    scheduler.sync([(2, 'b'), (3, 'c')], now=0.5)
+
+    assert scheduler.pop_due(now=0.5).ticker_ids == [3]
+    assert scheduler.pop_due(now=1).ticker_ids == [2]
+    assert len(scheduler) == 2
+
+
+@pytest.mark.parametrize('interval', [0.0, -1.0])
+def test_scheduler_updates_back_to_back_without_positive_interval(interval):
+    scheduler = TickerScheduler(default_interval=interval, tiers=[Tier('hot_.*', interval)])
+    scheduler.sync([(1, 'hot_a'), (2, 'b')], now=0)
+
+    batches = [scheduler.pop_due(now=now) for now in (0, 0, 0.5)]
+
+    assert batches == [DueTickers([1, 2], 0)] * 3
+    assert scheduler.next_due_at() == 0.5
+    assert scheduler.shortest_interval == 0.0
+
+
+@pytest.mark.parametrize('ticks', [10, 2])
+def test_fill_history(ticks):
+    names = [_create_ticker_price(prices={}) for _ in range(3)]
+    started_at = datetime(2022, 3, 1, tzinfo=timezone.utc)
+
+    with db.create_session() as session:
+        ticker_ids = session.execute(sa.select(db.Ticker.id).where(db.Ticker.name.in_(names))).scalars().all()
+        rows = history.fill_history(
+            session, ticker_ids, started_at=started_at, ticks=ticks, tick_interval=timedelta(seconds=5), chunk_size=4
+        )
+
+    assert rows == 3 * ticks
+    with db.create_session() as session:
+        for ticker in session.query(db.Ticker).filter(db.Ticker.name.in_(names)):
+            prices = [p.price for p in ticker.prices]
+            assert [p.created_at for p in ticker.prices] == [
+                started_at + timedelta(seconds=5 * i) for i in range(ticks)
+            ]
+            assert {abs(b - a) for a, b in zip([0, *prices], prices)} == {1}
+            assert (ticker.last_price.price_id, ticker.last_price.price) == (ticker.prices[-1].id, prices[-1])
+
+
+def test_update_prices_returns_published_messages():
+    ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=1): 15})
+
+    messages = _update_prices(price_diff_generator=lambda: -1)
+
+    assert [(m.name, m.price) for m in messages] == [(ticker_name, Decimal(14))]
+
+
+@pytest.mark.asyncio
+async def test_publish_prices():
+    redis = await get_redis()
+    prices = [
+        TickerPrice(name=name, price=price, created_at=datetime(year=2022, month=3, day=1, tzinfo=timezone.utc))
+        for name, price in [('ticker_a', 1), ('ticker_b', 2)]
+    ]
+
+    async with redis.pubsub() as reader:
+        await reader.subscribe('ticker_a', 'ticker_b')
+        await _publish(redis, prices)
+        received = [await reader.get_message(ignore_subscribe_messages=True, timeout=1) for _ in range(4)]
+
+    received_prices = [RedisPriceMessage.parse_obj(m).payload for m in received if m]
+    assert received_prices == prices
+    await redis.connection_pool.disconnect()
+
+
+def test_update_prices_maintains_candles(client):
+    ticker_name = _create_ticker_price(prices={})
+
+    for movement in (0, 3, -5, 1):
+        _update_prices(price_diff_generator=lambda: movement)
+
+    with db.create_session() as session:
+        ticker: db.Ticker = session.query(db.Ticker).filter(db.Ticker.name == ticker_name).one()
+        ticks = [(p.created_at, p.price) for p in ticker.prices]
+    expected_candles: dict[datetime, list[Decimal]] = {}
+    for created_at, price in ticks:
+        started_at = datetime.fromtimestamp(created_at.timestamp() // 300 * 300, tz=timezone.utc)
+        expected_candles.setdefault(started_at, []).append(price)
+
+    response = client.get('/ticker-candles', params={'ticker_name': ticker_name, 'resolution': '5m'})
+    assert response.status_code == HTTPStatus.OK
+    assert [
+        (datetime.fromisoformat(c['started_at']), c['open'], c['high'], c['low'], c['close']) for c in response.json()
+    ] == [(at, p[0], max(p), min(p), p[-1]) for at, p in expected_candles.items()]
+    assert [p for _, p in ticks] == [0, 3, -2, -1]
+
+
+def test_backfill_candles(client):
+    prices = {datetime(year=2022, month=3, day=1, minute=m, tzinfo=timezone.utc): m * (-1) ** m for m in range(10)}
+    ticker_name = _create_ticker_price(prices=prices)
+
+    backfill_candles()
+
+    response = client.get('/ticker-candles', params={'ticker_name': ticker_name, 'resolution': '5m'})
+    assert [(c['started_at'], c['open'], c['high'], c['low'], c['close']) for c in response.json()] == [
+        ('2022-03-01T00:00:00+00:00', 0, 4, -3, 4),
+        ('2022-03-01T00:05:00+00:00', -5, 8, -9, -9),
+    ]
+
+
+def test_backfill_candles_skips_null_prices(client):
+    prices = {datetime(year=2022, month=3, day=1, minute=m, tzinfo=timezone.utc): m for m in range(1, 4)}
+    prices[datetime(year=2022, month=3, day=1, tzinfo=timezone.utc)] = None
+    prices[datetime(year=2022, month=3, day=1, minute=5, tzinfo=timezone.utc)] = None
+    ticker_name = _create_ticker_price(prices=dict(sorted(prices.items())))
+
+    backfill_candles()
+
+    response = client.get('/ticker-candles', params={'ticker_name': ticker_name, 'resolution': '5m'})
+    assert [(c['started_at'], c['open'], c['high'], c['low'], c['close']) for c in response.json()] == [
+        ('2022-03-01T00:00:00+00:00', 1, 3, 1, 3),
+    ]
+
+
+def test_latest_prices_prefer_feed_over_database():
+    first_ticker = _create_ticker_price(prices={datetime(year=2022, month=3, day=1, tzinfo=timezone.utc): 1})
+    second_ticker = _create_ticker_price(prices={datetime(year=2022, month=3, day=1, tzinfo=timezone.utc): 2})
+    latest_prices = LatestPrices()
+
+    latest_prices.update_from_message(json.dumps([{'name': first_ticker, 'price': 5}]))
+
+    async def _load_latest_prices():
+        prices = await load_latest_prices()
+        await db.dispose_async_engine()
+        return prices
+
+    latest_prices.warm(asyncio.run(_load_latest_prices()))
+
+    assert sorted((p['name'], p['price']) for p in json.loads(latest_prices.encoded())) == sorted(
+        [(first_ticker, 5), (second_ticker, 2)]
+    )
+    assert [p['price'] for p in json.loads(latest_prices.encoded([second_ticker, 'unknown']))] == [2]
+
+
+@pytest.mark.parametrize('data', ['not json', '{"name": "a"}', '[1, 2]', '[{"price": 1}]'])
+def test_latest_prices_ignore_malformed_message(data):
+    latest_prices = LatestPrices()
+    latest_prices.update_from_message(json.dumps([{'name': 'a', 'price': 1}]))
+
+    latest_prices.update_from_message(data)
+
+    assert json.loads(latest_prices.encoded()) == [{'name': 'a', 'price': 1}]
+
+
+def test_get_latest_prices(app):
+    ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=1, tzinfo=timezone.utc): 1})
+    other_ticker_name = _create_ticker_price(prices={datetime(year=2022, month=3, day=1, tzinfo=timezone.utc): 2})
+
+    async def _publish_board():
+        redis = await get_redis()
+        price = TickerPrice(
+            name=ticker_name, price=7, created_at=datetime(year=2022, month=3, day=2, tzinfo=timezone.utc)
+        )
+        await _publish(redis, [price], board_channel=RedisSettings().board_channel)
+        await redis.connection_pool.disconnect()
+
+    with TestClient(app) as client:
+        response = client.get('/ticker-prices/latest')
+        assert response.status_code == HTTPStatus.OK
+        assert sorted(p['price'] for p in response.json()) == [1, 2]
+
+        asyncio.run(_publish_board())
+        _wait_until(
+            lambda: client.get('/ticker-prices/latest', params={'tickers': [ticker_name]}).json()[0]['price'] == 7
+        )
+
+        response = client.get('/ticker-prices/latest', params={'tickers': [other_ticker_name]})
+        assert [(p['name'], p['price']) for p in response.json()] == [(other_ticker_name, 2)]
+
+
+@pytest.mark.asyncio
+async def test_price_hub_ignores_handler_channels():
+    messages = []
+    hub = PriceHub(redis_factory=get_redis)
+    hub.add_channel_handler('board', messages.append)
+    await hub.start()
+    queue = hub.create_send_queue()
+
+    await hub.subscribe('board', queue)
+    await hub.unsubscribe('board', queue)
+    assert hub.subscriptions == {}
+
+    hub.add_channel_handler('broken', lambda data: data['price'])
+    hub._dispatch({'type': 'message', 'channel': 'broken', 'data': '[]'})
+
+    redis = await get_redis()
+    await redis.publish('board', 'update')
+    deadline = time.monotonic() + 5
+    while not messages:
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.01)
+    assert messages == ['update']
+
+    await hub.stop()
+    await redis.connection_pool.disconnect()
+
+
+def _price_partitions(ticker_name):
+    with db.create_session() as session:
+        return (
+            session.execute(
+                sa.text(
+                    'SELECT ticker_price.tableoid::regclass::text FROM ticker_price '
+                    'JOIN ticker ON ticker.id = ticker_price.ticker_id '
+                    'WHERE ticker.name = :name ORDER BY ticker_price.id'
+                ),
+                {'name': ticker_name},
+            )
+            .scalars()
+            .all()
+        )
+
+
+def test_create_partitions_moves_rows_from_default_partition():
+    ticker_name = _create_ticker_price(
+        prices={datetime(2022, 3, 1, 12, tzinfo=timezone.utc): 1, datetime(2022, 3, 3, tzinfo=timezone.utc): 2}
+    )
+    assert _price_partitions(ticker_name) == [db.TICKER_PRICE_DEFAULT_PARTITION] * 2
+
+    with db.create_session() as session:
+        created = partitions.create_partitions(session, first_day=date(2022, 3, 1), days=2)
+    with db.create_session() as session:
+        created_again = partitions.create_partitions(session, first_day=date(2022, 3, 1), days=3)
+
+    assert created == ['ticker_price_p20220301', 'ticker_price_p20220302']
+    assert created_again == ['ticker_price_p20220303']
+    assert _price_partitions(ticker_name) == ['ticker_price_p20220301', 'ticker_price_p20220303']
+
+
+@pytest.mark.parametrize('archive_schema', [None, 'test_price_archive'])
+def test_retire_partitions(archive_schema):
+    ticker_name = _create_ticker_price(
+        prices={datetime(2022, 3, d, tzinfo=timezone.utc): d for d in range(1, 4)},
+    )
+    with db.create_session() as session:
+        partitions.create_partitions(session, first_day=date(2022, 3, 1), days=3)
+
+    try:
+        with db.create_session() as session:
+            retired = partitions.retire_partitions(session, before=date(2022, 3, 3), archive_schema=archive_schema)
+
+        assert retired == ['ticker_price_p20220301', 'ticker_price_p20220302']
+        assert _price_partitions(ticker_name) == ['ticker_price_p20220303']
+        if archive_schema:
+            with db.create_session() as session:
+                archived = session.execute(
+                    sa.text(f'SELECT price FROM {archive_schema}.ticker_price_p20220302').columns(price=db.PRICE_TYPE)
+                )
+                assert archived.scalars().all() == [2]
+    finally:
+        with db.create_session() as session:
+            session.execute(sa.text('DROP SCHEMA IF EXISTS test_price_archive CASCADE'))
+
+
+def test_manage_partitions_premakes_days(monkeypatch):
+    monkeypatch.setenv('PARTITION_PREMAKE_DAYS', '2')
+
+    manage_partitions()
+
+    today = datetime.now(timezone.utc).date()
+    with db.create_session() as session:
+        tables = session.execute(
+            sa.text("SELECT relname FROM pg_class WHERE relname LIKE 'ticker_price_p%' AND relkind = 'r'")
+        )
+        assert sorted(tables.scalars()) == [partitions.partition_name(today + timedelta(days=d)) for d in range(3)]
 
 
 def test_parse_redis_message():